@@ -0,0 +1,542 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+###############################################################################
+
+"""
+CSW stand-in server for offline benchmarking
+
+Answers GetCapabilities, GetRecords and GetRecordById with synthetic
+records, or replays responses recorded from a live catalogue.  Latency,
+bandwidth and failures can be injected to mimic slow or flaky services.
+
+    python benchmark/cswserver.py --records 100000 --latency 0.2
+
+Synthetic record i has the keyword WORDS[i % len(WORDS)]; a csw:AnyText
+PropertyIsLike on one of these words selects every len(WORDS)th record,
+so that searches over millions of records cost nothing.  Other
+constraints are ignored.
+"""
+
+import argparse
+import BaseHTTPServer
+from collections import Counter
+import gzip
+import hashlib
+import json
+import os
+import random
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+import threading
+import time
+from urllib import urlencode
+import urllib2
+from urlparse import parse_qsl, urlparse
+from xml.etree import ElementTree as etree
+from xml.sax.saxutils import escape, quoteattr
+
+NAMESPACES = {
+    'csw': 'http://www.opengis.net/cat/csw/2.0.2',
+    'dc': 'http://purl.org/dc/elements/1.1/',
+    'dct': 'http://purl.org/dc/terms/',
+    'ogc': 'http://www.opengis.net/ogc',
+    'ows': 'http://www.opengis.net/ows',
+    'xlink': 'http://www.w3.org/1999/xlink',
+}
+
+XMLNS = ' '.join(['xmlns:%s="%s"' % item for item in
+                  sorted(NAMESPACES.items())])
+
+WORDS = ['water', 'soil', 'roads', 'land', 'forest', 'climate',
+         'population', 'elevation', 'geology', 'coast']
+
+# words found in every synthetic record
+COMMON_WORDS = ['', 'synthetic', 'record']
+
+IDENTIFIER = 'urn:uuid:synthetic-%08d'
+
+CAPABILITIES = '''<?xml version="1.0" encoding="UTF-8"?>
+<csw:Capabilities %(xmlns)s version="2.0.2">
+<ows:ServiceIdentification>
+<ows:Title>CSW stand-in</ows:Title>
+<ows:Abstract>%(records)d synthetic records</ows:Abstract>
+<ows:ServiceType>CSW</ows:ServiceType>
+<ows:ServiceTypeVersion>2.0.2</ows:ServiceTypeVersion>
+</ows:ServiceIdentification>
+<ows:ServiceProvider><ows:ProviderName>MetaSearch</ows:ProviderName>
+</ows:ServiceProvider>
+<ows:OperationsMetadata>%(operations)s</ows:OperationsMetadata>
+<ogc:Filter_Capabilities><ogc:Spatial_Capabilities/>
+<ogc:Scalar_Capabilities/></ogc:Filter_Capabilities>
+</csw:Capabilities>'''
+
+OPERATION = '''
+<ows:Operation name="%s"><ows:DCP><ows:HTTP>
+<ows:Get xlink:href=%s/><ows:Post xlink:href=%s/>
+</ows:HTTP></ows:DCP></ows:Operation>'''
+
+EXCEPTION = '''<?xml version="1.0" encoding="UTF-8"?>
+<ows:ExceptionReport %s version="1.2.0">
+<ows:Exception exceptionCode="NoApplicableCode">
+<ows:ExceptionText>%s</ows:ExceptionText>
+</ows:Exception></ows:ExceptionReport>'''
+
+
+def local_name(tag):
+    """return a tag without its namespace"""
+
+    return tag.rsplit('}', 1)[-1]
+
+
+def getrecords_response(records, matches, nextrecord=0, esn='full'):
+    """return a GetRecords response holding records, a list of XML strings"""
+
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<csw:GetRecordsResponse %s version="2.0.2">'
+            '<csw:SearchStatus timestamp="%s"/>'
+            '<csw:SearchResults numberOfRecordsMatched="%d" '
+            'numberOfRecordsReturned="%d" nextRecord="%d" '
+            'elementSet="%s">%s</csw:SearchResults>'
+            '</csw:GetRecordsResponse>' % (
+                XMLNS, time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                matches, len(records), nextrecord, escape(esn),
+                ''.join(records)))
+
+
+class Catalogue(object):
+    """synthetic records, generated on demand from their position"""
+
+    def __init__(self, count=1000):
+        self.count = count
+
+    def word(self, i):
+        return WORDS[i % len(WORDS)]
+
+    def index(self, identifier):
+        """return the position of the record identifier, or None"""
+
+        try:
+            i = int(identifier.rsplit('-', 1)[-1])
+        except ValueError:
+            return None
+        if 0 <= i < self.count and identifier == IDENTIFIER % i:
+            return i
+        return None
+
+    def select(self, keywords):
+        """
+        return (matches, position) for a search for keywords, where
+        position(j) is the index of the jth record found
+        """
+
+        words = set([word.lower() for word in keywords]) - set(COMMON_WORDS)
+        if not words:
+            return self.count, lambda j: j
+        if len(words) > 1 or list(words)[0] not in WORDS:
+            return 0, None
+
+        k = WORDS.index(words.pop())
+        step = len(WORDS)
+        matches = max(0, (self.count - k + step - 1) // step)
+        return matches, lambda j: k + j * step
+
+    def record(self, i, esn='full', url=''):
+        """return record i as XML of the element set esn"""
+
+        word = self.word(i)
+        lon = (i * 37) % 340 - 170
+        lat = (i * 17) % 160 - 80
+        fields = [
+            '<dc:identifier>%s</dc:identifier>' % (IDENTIFIER % i),
+            '<dc:title>Synthetic %s record %d</dc:title>' % (word, i),
+            '<dc:type>dataset</dc:type>',
+        ]
+
+        if esn in ['summary', 'full']:
+            fields.extend([
+                '<dc:subject>%s</dc:subject>' % word,
+                '<dc:format>application/xml</dc:format>',
+                '<dct:modified>2014-%02d-%02d</dct:modified>' % (
+                    i % 12 + 1, i % 28 + 1),
+                '<dct:abstract>%s</dct:abstract>' % escape(
+                    ('Synthetic %s record %d served by the CSW stand-in. ' %
+                     (word, i)) * 4),
+            ])
+
+        if esn == 'full':
+            fields.extend([
+                '<dc:creator>MetaSearch</dc:creator>',
+                '<dc:publisher>MetaSearch</dc:publisher>',
+                '<dc:language>en</dc:language>',
+                '<dc:rights>public</dc:rights>',
+                '<dct:references scheme="OGC:WMS">%s/wms?layer=%d'
+                '</dct:references>' % (escape(url), i),
+            ])
+
+        fields.append(
+            '<ows:BoundingBox crs="urn:x-ogc:def:crs:EPSG:6.11:4326">'
+            '<ows:LowerCorner>%d %d</ows:LowerCorner>'
+            '<ows:UpperCorner>%d %d</ows:UpperCorner>'
+            '</ows:BoundingBox>' % (lat, lon, lat + 5, lon + 5))
+
+        tag = {'brief': 'BriefRecord', 'summary': 'SummaryRecord'}.get(
+            esn, 'Record')
+        return '<csw:%s>%s</csw:%s>' % (tag, ''.join(fields), tag)
+
+
+class Recordings(object):
+    """responses of a live catalogue, stored in a directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def key(self, method, query, body):
+        """return the name a request is recorded under"""
+
+        if method == 'GET':
+            params = sorted([(name.lower(), value) for name, value in
+                             parse_qsl(query, keep_blank_values=True)])
+            request = urlencode(params)
+        else:
+            request = body
+        return hashlib.sha1('%s %s' % (method, request)).hexdigest()
+
+    def get(self, key):
+        """return (status, content type, body, upstream URL), or None"""
+
+        filename = os.path.join(self.directory, key)
+        if not os.path.exists('%s.json' % filename):
+            return None
+        with open('%s.json' % filename) as fileobj:
+            meta = json.load(fileobj)
+        with open('%s.xml' % filename, 'rb') as fileobj:
+            body = fileobj.read()
+        return meta['status'], meta['content_type'], body, meta['upstream']
+
+    def put(self, key, status, content_type, body, upstream, request):
+        filename = os.path.join(self.directory, key)
+        with open('%s.xml' % filename, 'wb') as fileobj:
+            fileobj.write(body)
+        with open('%s.json' % filename, 'w') as fileobj:
+            json.dump({'status': status, 'content_type': content_type,
+                       'upstream': upstream, 'request': request}, fileobj,
+                      indent=4)
+
+
+class StandInServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """CSW stand-in; see the module docstring"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 8000), records=1000,
+                 latency=0, bandwidth=0, error_rate=0, exception_rate=0,
+                 recordings=None, upstream=None, compress=False, seed=0):
+        """
+        latency is the delay in seconds before each response, bandwidth
+        the bytes per second sent (0: unlimited); error_rate and
+        exception_rate are the fractions of requests answered with HTTP
+        500 and with an ows:ExceptionReport.  Requests found in the
+        recordings directory are replayed; with upstream, the URL of a live
+        catalogue, requests are forwarded to it and recorded
+        """
+
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+
+        self.catalogue = Catalogue(records)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.exception_rate = exception_rate
+        self.recordings = None
+        if recordings is not None:
+            self.recordings = Recordings(recordings)
+        self.upstream = upstream
+        self.compress = compress
+
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.counts = Counter()
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%d/csw' % (host, port)
+
+    def start(self):
+        """serve from a background thread"""
+
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, operation):
+        with self.lock:
+            self.counts[operation] += 1
+
+    def inject(self):
+        """return 'error', 'exception' or None for the next response"""
+
+        with self.lock:
+            value = self.random.random()
+        if value < self.error_rate:
+            return 'error'
+        if value < self.error_rate + self.exception_rate:
+            return 'exception'
+        return None
+
+    def respond(self, method, query, body):
+        """return (status, content type, body) answering a request"""
+
+        if self.recordings is not None:
+            key = self.recordings.key(method, query, body)
+            if self.upstream is not None:
+                status, content_type, data = self.forward(method, query,
+                                                          body)
+                self.recordings.put(key, status, content_type, data,
+                                    self.upstream, query or body)
+                return status, content_type, self.rebase(data, self.upstream)
+            recorded = self.recordings.get(key)
+            if recorded is not None:
+                status, content_type, data, upstream = recorded
+                self.count('replay')
+                return status, content_type, self.rebase(data, upstream)
+
+        try:
+            return 200, 'application/xml', self.synthesize(method, query,
+                                                           body)
+        except ValueError as err:
+            return 200, 'application/xml', EXCEPTION % (XMLNS,
+                                                        escape(str(err)))
+
+    def forward(self, method, query, body):
+        """send a request to the upstream catalogue"""
+
+        if method == 'GET':
+            separator = '&' if '?' in self.upstream else '?'
+            request = urllib2.Request('%s%s%s' % (self.upstream, separator,
+                                                  query))
+        else:
+            request = urllib2.Request(self.upstream, body,
+                                      {'Content-Type': 'application/xml'})
+        try:
+            response = urllib2.urlopen(request, timeout=60)
+        except urllib2.HTTPError as err:
+            response = err
+        self.count('forward')
+        return (response.code, response.info().gettype(), response.read())
+
+    def rebase(self, data, upstream):
+        """point the URLs of a recorded response at this server"""
+
+        return data.replace(upstream, self.url)
+
+    def synthesize(self, method, query, body):
+        """answer a request from the synthetic catalogue"""
+
+        if method == 'GET':
+            params = dict([(name.lower(), value) for name, value in
+                           parse_qsl(query, keep_blank_values=True)])
+            request = params.get('request', '')
+            if request == 'GetCapabilities':
+                self.count('GetCapabilities')
+                return self.capabilities()
+            if request == 'GetRecordById':
+                self.count('GetRecordById')
+                return self.getrecordbyid(
+                    params.get('id', '').split(','),
+                    params.get('elementsetname', 'full'))
+            raise ValueError('Unsupported request %r' % request)
+
+        try:
+            root = etree.fromstring(body)
+        except SyntaxError:
+            raise ValueError('Request is not XML')
+        request = local_name(root.tag)
+        if request == 'GetCapabilities':
+            self.count('GetCapabilities')
+            return self.capabilities()
+        if request == 'GetRecordById':
+            self.count('GetRecordById')
+            ids = [elem.text for elem in root.iter() if
+                   local_name(elem.tag) == 'Id']
+            esn = [elem.text for elem in root.iter() if
+                   local_name(elem.tag) == 'ElementSetName']
+            return self.getrecordbyid(ids, (esn or ['full'])[0])
+        if request == 'GetRecords':
+            self.count('GetRecords')
+            return self.getrecords(root)
+        raise ValueError('Unsupported request %r' % request)
+
+    def capabilities(self):
+        url = quoteattr(self.url)
+        operations = ''.join([OPERATION % (name, url, url) for name in
+                              ['GetCapabilities', 'GetRecords',
+                               'GetRecordById']])
+        return CAPABILITIES % {'xmlns': XMLNS, 'operations': operations,
+                               'records': self.catalogue.count}
+
+    def getrecords(self, root):
+        hits = root.get('resultType') == 'hits'
+        start = max(1, int(root.get('startPosition', 1)))
+        maxrecords = int(root.get('maxRecords', 10))
+
+        esn = 'full'
+        keywords = []
+        for elem in root.iter():
+            name = local_name(elem.tag)
+            if name == 'ElementSetName':
+                esn = elem.text
+            elif name == 'Literal' and elem.text:
+                keywords.extend([word.strip('%*_?') for word in
+                                 elem.text.split()])
+
+        matches, position = self.catalogue.select(keywords)
+        if hits:
+            positions = []
+        else:
+            positions = range(start - 1, min(matches, start - 1 + maxrecords))
+        nextrecord = start + len(positions)
+        if nextrecord > matches or hits:
+            nextrecord = 0
+
+        records = [self.catalogue.record(position(j), esn, self.url)
+                   for j in positions]
+        return getrecords_response(records, matches, nextrecord, esn)
+
+    def getrecordbyid(self, ids, esn):
+        records = []
+        for identifier in ids:
+            i = self.catalogue.index(identifier.strip())
+            if i is not None:
+                records.append(self.catalogue.record(i, esn, self.url))
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<csw:GetRecordByIdResponse %s>%s'
+                '</csw:GetRecordByIdResponse>' % (XMLNS, ''.join(records)))
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """HTTP/1.1 keep-alive handler of StandInServer"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.answer('GET', urlparse(self.path).query, '')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.answer('POST', '', self.rfile.read(length))
+
+    def answer(self, method, query, body):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+
+        injected = server.inject()
+        if injected == 'error':
+            server.count('error')
+            status, content_type, data = 500, 'text/plain', 'Injected failure'
+        elif injected == 'exception':
+            server.count('exception')
+            status, content_type, data = 200, 'application/xml', \
+                EXCEPTION % (XMLNS, 'Injected exception')
+        else:
+            status, content_type, data = server.respond(method, query, body)
+
+        encoding = None
+        if server.compress and \
+                'gzip' in self.headers.get('Accept-Encoding', ''):
+            encoding = 'gzip'
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as fileobj:
+                fileobj.write(data)
+            data = buf.getvalue()
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+
+        if not server.bandwidth:
+            self.wfile.write(data)
+            return
+
+        # ten writes per second at the given rate
+        chunk = max(1, server.bandwidth // 10)
+        for offset in range(0, len(data), chunk):
+            self.wfile.write(data[offset:offset + chunk])
+            self.wfile.flush()
+            time.sleep(float(chunk) / server.bandwidth)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CSW stand-in server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--records', type=int, default=1000,
+                        help='number of synthetic records')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds before each response')
+    parser.add_argument('--bandwidth', type=int, default=0,
+                        help='bytes per second (default: unlimited)')
+    parser.add_argument('--errors', type=float, default=0,
+                        help='fraction of requests failing with HTTP 500')
+    parser.add_argument('--exceptions', type=float, default=0,
+                        help='fraction of requests answered with an '
+                        'ows:ExceptionReport')
+    parser.add_argument('--recordings',
+                        help='directory of recorded responses to replay')
+    parser.add_argument('--record', metavar='URL',
+                        help='forward requests to the catalogue at URL and '
+                        'record them in --recordings')
+    parser.add_argument('--gzip', action='store_true',
+                        help='compress responses')
+    args = parser.parse_args()
+
+    if args.record and not args.recordings:
+        parser.error('--record needs --recordings')
+
+    server = StandInServer((args.host, args.port), args.records,
+                           args.latency, args.bandwidth, args.errors,
+                           args.exceptions, args.recordings, args.record,
+                           args.gzip)
+    print('Serving %s' % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+###############################################################################
+
+"""
+benchmarks of the result processing hot paths
+
+Each scenario is timed with responses of 10 to 10,000 synthetic records
+and compared with a JSON baseline; a scenario slower than the baseline
+by more than the threshold fails the run. Each sample repeats a scenario
+for at least 0.2 s, and slowdowns below an absolute noise floor are
+ignored, so that millisecond scenarios do not fail on jitter.
+
+    python benchmark/suite.py --save       # record a baseline
+    python benchmark/suite.py              # compare with it
+
+Only OWSLib parsing runs without QGIS; the other scenarios drive the
+plugin and are skipped when the qgis module cannot be imported.
+Baselines only compare runs on the same machine, so none is committed:
+save one from the base revision, then compare the change with it.
+"""
+
+import argparse
+from collections import OrderedDict
+import imp
+import json
+import os
+import platform
+import site
+from StringIO import StringIO
+import sys
+import timeit
+
+from owslib.csw import CatalogueServiceWeb
+from owslib.etree import etree
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGIN_DIR = os.path.join(BASEDIR, 'plugin', 'MetaSearch_geocode')
+sys.path.insert(0, BASEDIR)
+
+# the plugin package without its __init__, which starts a pydevd debugger;
+# the paths it adds are added here
+if 'MetaSearch_geocode' not in sys.modules:
+    PACKAGE = imp.new_module('MetaSearch_geocode')
+    PACKAGE.__path__ = [PLUGIN_DIR]
+    sys.modules['MetaSearch_geocode'] = PACKAGE
+for directory in [PLUGIN_DIR, os.path.join(PLUGIN_DIR, 'ui')]:
+    if directory not in sys.path:
+        sys.path.append(directory)
+site.addsitedir(os.path.join(PLUGIN_DIR, 'ext-libs'))
+
+from benchmark.cswserver import Catalogue, getrecords_response  # noqa
+
+SIZES = [10, 100, 1000, 10000]
+
+BASELINE = os.path.join(BASEDIR, 'benchmark', 'baseline.json')
+
+# a scenario more than this much slower than its baseline is a regression,
+# unless it is slower by less than NOISE_FLOOR seconds
+THRESHOLD = 0.2
+NOISE_FLOOR = 0.002
+
+# each timing sample runs a scenario often enough to take this many
+# seconds; the fastest of REPEAT samples counts
+MIN_SAMPLE = 0.2
+REPEAT = 7
+
+
+class FixtureCatalogue(CatalogueServiceWeb):
+    """CatalogueServiceWeb answering with a canned response"""
+
+    def __init__(self, response):
+        CatalogueServiceWeb.__init__(self, 'http://127.0.0.1/csw',
+                                     skip_caps=True)
+        self.fixture = response
+
+    def _invoke(self):
+        self.response = self.fixture
+        self._exml = etree.parse(StringIO(self.response))
+        self.exceptionreport = None
+
+
+def fixture(size, esn='full'):
+    """return a GetRecords response of size synthetic records"""
+
+    catalogue = Catalogue(size)
+    records = [catalogue.record(i, esn, 'http://127.0.0.1/csw')
+               for i in range(size)]
+    return getrecords_response(records, size, 0, esn)
+
+
+def parse(response, size):
+    """return a FixtureCatalogue holding the records of response"""
+
+    catalog = FixtureCatalogue(response)
+    catalog.getrecords2(esn='full', maxrecords=size)
+    return catalog
+
+
+class Plugin(object):
+    """a MetaSearch dialog running in a QGIS application without iface"""
+
+    def __init__(self):
+        from qgis.core import QgsApplication
+        from qgis.gui import QgsMapCanvas
+
+        self.app = QgsApplication([], True)
+        QgsApplication.setPrefixPath(
+            os.environ.get('QGIS_PREFIX_PATH', '/usr'), True)
+        QgsApplication.initQgis()
+        self.canvas = QgsMapCanvas()
+
+        from MetaSearch_geocode.dialogs.maindialog import MetaSearchDialog
+        self.dialog = MetaSearchDialog(self)
+
+    def mapCanvas(self):
+        return self.canvas
+
+    def mainWindow(self):
+        return None
+
+
+def bench_parse(plugin, size):
+    response = fixture(size)
+    return lambda: parse(response, size)
+
+
+def bench_display_results(plugin, size):
+    dialog = plugin.dialog
+    catalog = parse(fixture(size), size)
+
+    def run():
+        dialog.catalog = catalog
+        dialog.startfrom = 0
+        dialog.display_results()
+    return run
+
+
+def bench_find_services(plugin, size):
+    from PyQt4.QtGui import QTreeWidgetItem
+
+    records = parse(fixture(size), size).records.values()
+    items = [QTreeWidgetItem() for record in records]
+
+    def run():
+        for record, item in zip(records, items):
+            plugin.dialog.find_services(record, item)
+    return run
+
+
+def bench_footprints(plugin, size):
+    from qgis.core import (QGis, QgsCoordinateReferenceSystem,
+                           QgsCoordinateTransform, QgsGeometry)
+    from MetaSearch_geocode.dialogs.maindialog import bbox_to_polygon
+
+    records = parse(fixture(size), size).records.values()
+    transform = QgsCoordinateTransform(QgsCoordinateReferenceSystem(4326),
+                                       QgsCoordinateReferenceSystem(3857))
+    rubber_band = plugin.dialog.rubber_band
+
+    def run():
+        rubber_band.reset(QGis.Polygon)
+        for record in records:
+            geom = QgsGeometry.fromPolygon(bbox_to_polygon(record.bbox))
+            geom.transform(transform)
+            rubber_band.addGeometry(geom, None)
+    return run
+
+
+def bench_render_template(plugin, size):
+    from MetaSearch_geocode.util import render_template
+
+    records = parse(fixture(size), size).records.values()
+    context = plugin.dialog.context
+
+    def run():
+        for record in records:
+            render_template('en', context, record, 'record_metadata_dc.html')
+    return run
+
+
+def bench_highlight_xml(plugin, size):
+    from MetaSearch_geocode.util import highlight_xml
+
+    response = fixture(size)
+    context = plugin.dialog.context
+    return lambda: highlight_xml(context, response)
+
+
+# name: (function returning the callable to time, whether it needs QGIS)
+SCENARIOS = OrderedDict([
+    ('parse', (bench_parse, False)),
+    ('display_results', (bench_display_results, True)),
+    ('find_services', (bench_find_services, True)),
+    ('footprints', (bench_footprints, True)),
+    ('render_template', (bench_render_template, True)),
+    ('highlight_xml', (bench_highlight_xml, True)),
+])
+
+
+def have_qgis():
+    try:
+        import qgis.core  # noqa
+    except ImportError:
+        return False
+    return True
+
+
+def autorange(timer, minimum=MIN_SAMPLE):
+    """return how many runs of timer take at least minimum seconds"""
+
+    timer.timeit(1)  # warm up caches and lazy imports
+    number = 1
+    while True:
+        seconds = timer.timeit(number)
+        if seconds >= minimum:
+            return number
+        # aim a little past minimum, growing tenfold at most
+        number = int(number * min(10, max(2, 1.2 * minimum /
+                                          max(seconds, 1e-9))))
+
+
+def run(sizes=SIZES, scenarios=None, repeat=REPEAT):
+    """
+    return an OrderedDict mapping 'scenario/size' to the seconds of one
+    run, from the fastest of repeat samples
+    """
+
+    plugin = None
+    qgis = have_qgis()
+    results = OrderedDict()
+
+    for name, (setup, needs_qgis) in SCENARIOS.items():
+        if scenarios and name not in scenarios:
+            continue
+        if needs_qgis and not qgis:
+            print('%-24s skipped: QGIS is not available' % name)
+            continue
+        if needs_qgis and plugin is None:
+            plugin = Plugin()
+
+        for size in sizes:
+            key = '%s/%d' % (name, size)
+            timer = timeit.Timer(setup(plugin, size))
+            number = autorange(timer)
+            results[key] = min(timer.repeat(repeat=repeat,
+                                            number=number)) / number
+            print('%-24s %10.4f s (%d x %d runs)' % (key, results[key],
+                                                     repeat, number))
+
+    return results
+
+
+def compare(results, baseline, threshold=THRESHOLD, floor=NOISE_FLOOR):
+    """
+    return (key, baseline, result, ratio) of the scenarios which are
+    more than threshold, and more than floor seconds, slower than in
+    baseline
+    """
+
+    regressions = []
+    for key, seconds in results.items():
+        if key not in baseline or not baseline[key]:
+            continue
+        ratio = seconds / baseline[key]
+        if ratio > 1 + threshold and seconds - baseline[key] > floor:
+            regressions.append((key, baseline[key], seconds, ratio))
+    return regressions
+
+
+def load_baseline(filename):
+    with open(filename) as fileobj:
+        return json.load(fileobj)['results']
+
+
+def save_baseline(filename, results):
+    with open(filename, 'w') as fileobj:
+        json.dump({'machine': platform.node(),
+                   'python': platform.python_version(),
+                   'results': results}, fileobj, indent=4)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='MetaSearch benchmarks')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='JSON baseline file (default: %(default)s)')
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='tolerated slowdown (default: %(default)s)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='numbers of records (default: %(default)s)')
+    parser.add_argument('--scenarios', nargs='+',
+                        choices=SCENARIOS.keys(),
+                        help='scenarios to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=REPEAT,
+                        help='samples per scenario; the best one counts')
+    parser.add_argument('--floor', type=float, default=NOISE_FLOOR,
+                        help='slowdowns in seconds ignored as noise '
+                        '(default: %(default)s)')
+    args = parser.parse_args(args)
+
+    results = run(args.sizes, args.scenarios, args.repeat)
+
+    if args.save:
+        save_baseline(args.baseline, results)
+        print('Baseline saved to %s' % args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('No baseline in %s; run with --save first' % args.baseline)
+        return 0
+
+    regressions = compare(results, load_baseline(args.baseline),
+                          args.threshold, args.floor)
+    for key, before, after, ratio in regressions:
+        print('REGRESSION %-24s %.4f s -> %.4f s (%+.0f%%)' % (
+            key, before, after, (ratio - 1) * 100))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
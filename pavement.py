@@ -20,8 +20,13 @@
 ###############################################################################
 
 import getpass
+import imp
+import importlib
+from multiprocessing.pool import ThreadPool
 import os
 import shutil
+import sys
+import time
 from urllib import urlencode
 from urllib2 import urlopen
 import xml.etree.ElementTree as etree
@@ -349,30 +354,173 @@ def upload():
 
 
 @task
+@cmdopts([
+    ('file=', 'f', 'connections file (default: the default connections)'),
+    ('timeout=', 't', 'seconds each service is given to answer'),
+])
 def test_default_csw_connections():
     """test that the default CSW connections work"""
 
     relpath = 'resources/connections-default.xml'
-    csw_connections_xml = options.base.plugin / relpath
-
-    csws = etree.parse(csw_connections_xml)
-
-    for csw in csws.findall('csw'):
-        # name = csw.attrib.get('name')
-        data = {
-            'service': 'CSW',
-            'version': '2.0.2',
-            'request': 'GetCapabilities'
-        }
-        values = urlencode(data)
-        url = '%s?%s' % (csw.attrib.get('url'), values)
-        content = urlopen(url)
+    csw_connections_xml = options.get('file', options.base.plugin / relpath)
+    timeout = int(options.get('timeout', 30))
+
+    csws = etree.parse(csw_connections_xml).findall('csw')
+
+    # all services are checked at the same time
+    pool = ThreadPool(min(len(csws), 16) or 1)
+    results = pool.map(lambda csw: check_csw(csw.attrib.get('url'), timeout),
+                       csws)
+    pool.close()
+
+    failed = []
+    for csw, (latency, version, size, err) in zip(csws, results):
+        name = csw.attrib.get('name')
+        if err is None:
+            info('OK     %6d ms  %s  %8d bytes  %s', latency, version, size,
+                 name)
+        else:
+            info('FAILED %6d ms  %s: %s', latency, name, err)
+            failed.append(name)
+
+    if failed:
+        raise ValueError('%d of %d services failed: %s' %
+                         (len(failed), len(csws), ', '.join(failed)))
+
+
+def check_csw(url, timeout):
+    """
+    send GetCapabilities to url; return latency in milliseconds, CSW
+    version, response size and None, or the error instead of the version
+    """
+
+    data = {
+        'service': 'CSW',
+        'version': '2.0.2',
+        'request': 'GetCapabilities'
+    }
+    values = urlencode(data)
+    started = time.time()
+    version = size = None
+    err = None
+    try:
+        content = urlopen('%s?%s' % (url, values), timeout=timeout)
         if content.getcode() != 200:
             raise ValueError('Bad HTTP status code')
-        csw_xml = etree.fromstring(content.read())
+        response = content.read()
+        size = len(response)
+        csw_xml = etree.fromstring(response)
         tag = '{http://www.opengis.net/cat/csw/2.0.2}Capabilities'
         if csw_xml.tag != tag:
             raise ValueError('root element should be csw:Capabilities')
+        version = csw_xml.attrib.get('version')
+    except Exception as err:
+        pass
+    latency = int((time.time() - started) * 1000)
+    return latency, version, size, err
+
+
+@task
+@cmdopts([
+    ('port=', 'p', 'port to listen on (default: 8000)'),
+    ('records=', 'n', 'number of synthetic records (default: 1000)'),
+    ('latency=', 'l', 'seconds before each response'),
+    ('bandwidth=', 'b', 'bytes per second (default: unlimited)'),
+    ('errors=', 'e', 'fraction of requests failing with HTTP 500'),
+    ('exceptions=', 'x', 'fraction of requests answered with an exception'),
+    ('recordings=', 'r', 'directory of recorded responses to replay'),
+    ('record=', 'u', 'URL of a catalogue to record into --recordings'),
+])
+def csw_server():
+    """run the CSW stand-in server for offline benchmarking"""
+
+    from benchmark.cswserver import StandInServer
+
+    if options.get('record') and not options.get('recordings'):
+        raise ValueError('--record needs --recordings')
+
+    server = StandInServer(
+        ('127.0.0.1', int(options.get('port', 8000))),
+        records=int(options.get('records', 1000)),
+        latency=float(options.get('latency', 0)),
+        bandwidth=int(options.get('bandwidth', 0)),
+        error_rate=float(options.get('errors', 0)),
+        exception_rate=float(options.get('exceptions', 0)),
+        recordings=options.get('recordings'),
+        upstream=options.get('record'))
+
+    info('Serving %s (Ctrl-C to stop)', server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+@task
+@cmdopts([
+    ('save', 's', 'store the results as the new baseline'),
+    ('baseline=', 'b', 'JSON baseline file'),
+    ('threshold=', 't', 'tolerated slowdown (default: 0.2)'),
+    ('floor=', 'f', 'slowdown in seconds ignored as noise (default: 0.002)'),
+    ('sizes=', 'n', 'comma separated numbers of records'),
+    ('scenarios=', 'c', 'comma separated scenarios to run'),
+])
+def benchmark():
+    """time the result processing hot paths against a baseline"""
+
+    from benchmark.suite import main
+
+    args = []
+    if options.get('save'):
+        args.append('--save')
+    if options.get('baseline'):
+        args.extend(['--baseline', options.get('baseline')])
+    if options.get('threshold'):
+        args.extend(['--threshold', options.get('threshold')])
+    if options.get('floor'):
+        args.extend(['--floor', options.get('floor')])
+    if options.get('sizes'):
+        args.append('--sizes')
+        args.extend(options.get('sizes').split(','))
+    if options.get('scenarios'):
+        args.append('--scenarios')
+        args.extend(options.get('scenarios').split(','))
+
+    if main(args):
+        raise ValueError('Performance regression beyond the threshold')
+
+
+@task
+@cmdopts([
+    ('file=', 'f', 'gazetteer dump, e.g. GeoNames cities1000.txt'),
+    ('output=', 'o', 'index file to write (default: gazetteer.idx)'),
+])
+def build_gazetteer():
+    """index a gazetteer dump for offline geocoding"""
+
+    build_index = plugin_module('gazetteer').build_index
+
+    if not options.get('file'):
+        raise ValueError('--file is required')
+
+    output = options.get('output', 'gazetteer.idx')
+    count = build_index(options.get('file'), output)
+    info('Indexed %d places in %s', count, output)
+
+
+def plugin_module(name):
+    """
+    import a module of the plugin without running the package __init__,
+    which needs QGIS
+    """
+
+    if 'MetaSearch_geocode' not in sys.modules:
+        package = imp.new_module('MetaSearch_geocode')
+        package.__path__ = [os.path.join(BASEDIR, 'plugin',
+                                         'MetaSearch_geocode')]
+        sys.modules['MetaSearch_geocode'] = package
+    return importlib.import_module('MetaSearch_geocode.%s' % name)
 
 
 def sphinx_make():
@@ -0,0 +1,562 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# CSW Client
+# ---------------------------------------------------------
+# QGIS Catalogue Service client.
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+###############################################################################
+
+from email.utils import mktime_tz, parsedate_tz
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from urllib import urlencode
+from urlparse import parse_qsl, urlsplit, urlunsplit
+
+from owslib.csw import CswRecord
+from owslib.etree import etree
+from owslib.util import OrderedDict
+
+LOGGER = logging.getLogger('MetaSearch(Geocode)')
+
+# KVP parameters which select an operation rather than an endpoint
+OWS_REQUEST_PARAMS = ['service', 'request', 'version', 'acceptversions']
+
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+
+def canonical_url(url):
+    """normalize a service URL so that equivalent endpoints compare equal"""
+
+    scheme, netloc, path, query, fragment = urlsplit(url.strip())
+    scheme = scheme.lower()
+    netloc = netloc.lower()
+
+    if ':' in netloc:
+        host, port = netloc.rsplit(':', 1)
+        if DEFAULT_PORTS.get(scheme) == port:
+            netloc = host
+
+    params = [(key, value) for key, value in
+              parse_qsl(query, keep_blank_values=True)
+              if key.lower() not in OWS_REQUEST_PARAMS]
+    params.sort()
+
+    return urlunsplit((scheme, netloc, path or '/', urlencode(params), ''))
+
+
+def write_file(filename, data):
+    """write data to filename, replacing any previous content atomically"""
+
+    tmp = '%s.tmp' % filename
+    with open(tmp, 'wb') as fileobj:
+        fileobj.write(data)
+    if os.name == 'nt' and os.path.exists(filename):
+        os.remove(filename)
+    os.rename(tmp, filename)
+
+
+class CapabilitiesCache(object):
+    """on-disk cache of GetCapabilities documents"""
+
+    def __init__(self, directory, ttl=86400):
+        """
+        directory is created if needed; entries older than ttl seconds
+        are ignored
+        """
+
+        self.directory = directory
+        self.ttl = ttl
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def filename(self, url):
+        """return cache filename for the given service URL"""
+
+        key = hashlib.sha1(canonical_url(url).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, '%s.xml' % key)
+
+    def get(self, url):
+        """return cached capabilities document, or None if missing/stale"""
+
+        filename = self.filename(url)
+        try:
+            age = time.time() - os.path.getmtime(filename)
+            if age > self.ttl:
+                return None
+            with open(filename, 'rb') as fileobj:
+                return fileobj.read()
+        except (IOError, OSError):
+            return None
+
+    def put(self, url, xml):
+        """store a capabilities document"""
+
+        try:
+            write_file(self.filename(url), xml)
+        except (IOError, OSError), err:
+            LOGGER.warning('Cannot cache capabilities of %s: %s', url, err)
+
+    def invalidate(self, url=None):
+        """drop the entry for url, or all entries if url is None"""
+
+        if url is not None:
+            filenames = [self.filename(url)]
+        else:
+            filenames = [os.path.join(self.directory, name) for name in
+                         os.listdir(self.directory) if name.endswith('.xml')]
+
+        for filename in filenames:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+
+class PageCache(object):
+    """bounded in-memory LRU of GetRecords result pages"""
+
+    def __init__(self, size=50):
+        """size is the maximum number of pages kept"""
+
+        self.size = size
+        self.pages = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.pages
+
+    def get(self, key):
+        """return the catalogue holding the page for key, or None"""
+
+        catalog = self.pages.pop(key, None)
+        if catalog is not None:
+            self.pages[key] = catalog  # most recently used
+        return catalog
+
+    def put(self, key, catalog):
+        """store the catalogue holding the page for key"""
+
+        self.pages.pop(key, None)
+        self.pages[key] = catalog
+        while len(self.pages) > self.size:
+            self.pages.popitem(last=False)
+
+    def clear(self):
+        """drop all pages"""
+
+        self.pages.clear()
+
+
+class RecordCache(object):
+    """
+    in-memory LRU of full records and their rendered HTML, keyed by
+    (catalogue URL, identifier); entries evicted from memory are spilled
+    to directory
+    """
+
+    def __init__(self, directory, size=200, ttl=604800):
+        """
+        size is the maximum number of records kept in memory; spilled
+        entries older than ttl seconds are ignored
+        """
+
+        self.directory = directory
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def key(self, url, identifier):
+        """return the cache key of a record"""
+
+        return canonical_url(url), identifier
+
+    def filename(self, key):
+        """return the spill filename of a cache key"""
+
+        digest = hashlib.sha1(u'\n'.join(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, '%s.json' % digest)
+
+    def get(self, url, identifier):
+        """return the cached owslib.csw.CswRecord, or None"""
+
+        entry = self._get(self.key(url, identifier))
+        if entry is None:
+            return None
+        return entry['record']
+
+    def get_html(self, url, identifier):
+        """return the cached rendering of a record, or None"""
+
+        entry = self._get(self.key(url, identifier))
+        if entry is None:
+            return None
+        return entry['html']
+
+    def put(self, url, identifier, record):
+        """store a full record, dropping any stale rendering"""
+
+        self._put(self.key(url, identifier), {'record': record, 'html': None})
+
+    def put_html(self, url, identifier, html):
+        """store the rendering of a cached record"""
+
+        entry = self._get(self.key(url, identifier))
+        if entry is not None:
+            entry['html'] = html
+
+    def flush(self):
+        """spill all entries to disk and drop expired spilled entries"""
+
+        for key, entry in self.entries.items():
+            self._spill(key, entry)
+
+        now = time.time()
+        for name in os.listdir(self.directory):
+            filename = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(filename) > self.ttl:
+                    os.remove(filename)
+            except OSError:
+                pass
+
+    def _get(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            entry = self._load(key)
+            if entry is None:
+                return None
+        self._put(key, entry)  # most recently used
+        return entry
+
+    def _put(self, key, entry):
+        self.entries.pop(key, None)
+        self.entries[key] = entry
+        while len(self.entries) > self.size:
+            self._spill(*self.entries.popitem(last=False))
+
+    def _spill(self, key, entry):
+        record = entry['record']
+        data = {'xml': record.xml.decode('utf-8'), 'html': entry['html'],
+                'xml_url': getattr(record, 'xml_url', None)}
+        try:
+            write_file(self.filename(key), json.dumps(data))
+        except (IOError, OSError), err:
+            LOGGER.warning('Cannot spill record %s: %s', key[1], err)
+
+    def _load(self, key):
+        filename = self.filename(key)
+        try:
+            if time.time() - os.path.getmtime(filename) > self.ttl:
+                return None
+            with open(filename, 'rb') as fileobj:
+                data = json.load(fileobj)
+            record = CswRecord(etree.fromstring(data['xml'].encode('utf-8')))
+        except (IOError, OSError, ValueError, KeyError, SyntaxError), err:
+            LOGGER.debug('Cannot load spilled record %s: %s', key[1], err)
+            return None
+
+        record.xml_url = data.get('xml_url')
+        return {'record': record, 'html': data.get('html')}
+
+
+def normalize_query(query):
+    """normalize a geocoding query so that equivalent spellings match"""
+
+    return u' '.join(query.lower().split())
+
+
+class GeocodeCache(object):
+    """
+    in-memory LRU of geocoding results, keyed by (provider, normalized
+    query) and written through to directory; each result maps addresses
+    to their bounding boxes
+    """
+
+    def __init__(self, directory, size=500, ttl=2592000):
+        """
+        size is the maximum number of queries kept in memory; results
+        older than ttl seconds are ignored
+        """
+
+        self.directory = directory
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def key(self, provider, query):
+        """return the cache key of a query"""
+
+        return provider, normalize_query(query)
+
+    def filename(self, key):
+        """return the filename of a cache key"""
+
+        digest = hashlib.sha1(u'\n'.join(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, '%s.json' % digest)
+
+    def get(self, provider, query):
+        """return the cached locations of query, or None"""
+
+        key = self.key(provider, query)
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            entry = self._load(key)
+        if entry is None or time.time() - entry[0] > self.ttl:
+            return None
+        self._remember(key, entry)  # most recently used
+        return dict(entry[1])
+
+    def put(self, provider, query, locations):
+        """store the locations found for query"""
+
+        key = self.key(provider, query)
+        entry = (time.time(), dict(locations))
+        self._remember(key, entry)
+
+        data = {'provider': key[0], 'query': key[1], 'time': entry[0],
+                'locations': entry[1]}
+        try:
+            write_file(self.filename(key), json.dumps(data))
+        except (IOError, OSError, TypeError, ValueError), err:
+            LOGGER.warning('Cannot cache locations of %s: %s', query, err)
+
+    def items(self):
+        """return the (query, locations) of all unexpired results on disk"""
+
+        now = time.time()
+        results = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'rb') as fileobj:
+                    data = json.load(fileobj)
+                if now - data['time'] <= self.ttl:
+                    results.append((data['query'], data['locations']))
+            except (IOError, OSError, ValueError, KeyError, TypeError):
+                continue
+        return results
+
+    def flush(self):
+        """drop expired entries from disk"""
+
+        now = time.time()
+        for name in os.listdir(self.directory):
+            filename = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(filename) > self.ttl:
+                    os.remove(filename)
+            except OSError:
+                pass
+
+    def clear(self):
+        """drop all entries"""
+
+        self.entries.clear()
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.directory, name))
+
+    def _remember(self, key, entry):
+        self.entries.pop(key, None)
+        self.entries[key] = entry
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def _load(self, key):
+        try:
+            with open(self.filename(key), 'rb') as fileobj:
+                data = json.load(fileobj)
+            locations = dict((address, tuple(bbox)) for address, bbox in
+                             data['locations'].items())
+            return data['time'], locations
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+
+def freshness(headers):
+    """
+    return the seconds a response may be used without revalidation,
+    from its Cache-Control and Expires headers
+    """
+
+    directives = {}
+    for directive in (headers.getheader('cache-control') or '').split(','):
+        name, _, value = directive.strip().partition('=')
+        directives[name.lower()] = value.strip('"')
+
+    if 'no-cache' in directives or 'must-revalidate' in directives:
+        return 0
+    if 'max-age' in directives:
+        try:
+            return max(0, int(directives['max-age']))
+        except ValueError:
+            return 0
+
+    expires = parsedate_tz(headers.getheader('expires') or '')
+    if expires is None:
+        return 0
+    date = parsedate_tz(headers.getheader('date') or '')
+    now = mktime_tz(date) if date is not None else time.time()
+    return max(0, mktime_tz(expires) - now)
+
+
+class HTTPCache(object):
+    """
+    on-disk cache of GET responses and their validators; stale entries
+    are revalidated with conditional requests by transport.CachingHandler
+    """
+
+    def __init__(self, directory, size=52428800):
+        """
+        directory is created if needed; the least recently used entries
+        are dropped once the responses take more than size bytes
+        """
+
+        self.directory = directory
+        self.size = size
+        self.lock = threading.Lock()
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def filename(self, url):
+        """return the cache filename, without extension, of a URL"""
+
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        return os.path.join(self.directory, hashlib.sha1(url).hexdigest())
+
+    def storable(self, headers):
+        """return whether a response with headers can be cached"""
+
+        if 'no-store' in (headers.getheader('cache-control') or ''):
+            return False
+        return any([headers.getheader('etag'),
+                    headers.getheader('last-modified'),
+                    freshness(headers) > 0])
+
+    def get(self, url):
+        """
+        return the cached entry of url as a dict with its body, etag,
+        last_modified, content_type and fresh_until, or None
+        """
+
+        filename = self.filename(url)
+        with self.lock:
+            try:
+                with open('%s.json' % filename) as fileobj:
+                    entry = json.load(fileobj)
+                with open('%s.body' % filename, 'rb') as fileobj:
+                    entry['body'] = fileobj.read()
+                os.utime('%s.body' % filename, None)  # recently used
+            except (IOError, OSError, ValueError):
+                return None
+        return entry
+
+    def put(self, url, headers, body):
+        """store a response; headers is its mimetools.Message"""
+
+        if not self.storable(headers):
+            return
+
+        entry = {
+            'url': url,
+            'etag': headers.getheader('etag'),
+            'last_modified': headers.getheader('last-modified'),
+            'content_type': headers.getheader('content-type'),
+            'fresh_until': time.time() + freshness(headers),
+        }
+
+        filename = self.filename(url)
+        with self.lock:
+            try:
+                write_file('%s.body' % filename, body)
+                write_file('%s.json' % filename, json.dumps(entry))
+            except (IOError, OSError), err:
+                LOGGER.warning('Cannot cache %s: %s', url, err)
+                return
+            self._prune()
+
+    def refresh(self, url, headers):
+        """
+        note a 304 Not Modified answer for url and return its entry, or
+        None if it is no longer cached
+        """
+
+        entry = self.get(url)
+        if entry is None:
+            return None
+
+        entry['fresh_until'] = time.time() + freshness(headers)
+        for key, header in [('etag', 'etag'),
+                            ('last_modified', 'last-modified')]:
+            if headers.getheader(header):
+                entry[key] = headers.getheader(header)
+
+        meta = dict([(key, value) for key, value in entry.items()
+                     if key != 'body'])
+        with self.lock:
+            try:
+                write_file('%s.json' % self.filename(url), json.dumps(meta))
+            except (IOError, OSError), err:
+                LOGGER.warning('Cannot cache %s: %s', url, err)
+        return entry
+
+    def clear(self):
+        """drop all entries"""
+
+        with self.lock:
+            for name in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, name))
+
+    def _prune(self):
+        """drop least recently used entries beyond the size limit"""
+
+        bodies = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.body'):
+                continue
+            filename = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            bodies.append((stat.st_mtime, stat.st_size, filename[:-5]))
+            total += stat.st_size
+
+        bodies.sort()
+        while total > self.size and bodies:
+            mtime, size, filename = bodies.pop(0)
+            for extension in ['body', 'json']:
+                try:
+                    os.remove('%s.%s' % (filename, extension))
+                except OSError:
+                    pass
+            total -= size
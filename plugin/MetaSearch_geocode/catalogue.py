@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# CSW Client
+# ---------------------------------------------------------
+# QGIS Catalogue Service client.
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+###############################################################################
+
+import base64
+import logging
+from StringIO import StringIO
+from urllib import urlencode
+from urllib2 import Request, urlopen
+
+from owslib import fes, ows, util
+from owslib.csw import CatalogueServiceWeb, CswRecord, namespaces
+from owslib.etree import etree
+from owslib.util import OrderedDict, add_namespaces, cleanup_namespaces
+
+from MetaSearch_geocode.cache import canonical_url
+
+LOGGER = logging.getLogger('MetaSearch(Geocode)')
+
+# root elements of a CSW response
+CSW_RESPONSES = [util.nspath_eval(element, namespaces) for element in [
+    'ows:ExceptionReport', 'csw:Capabilities', 'csw:DescribeRecordResponse',
+    'csw:GetDomainResponse', 'csw:GetRecordsResponse',
+    'csw:GetRecordByIdResponse', 'csw:HarvestResponse',
+    'csw:TransactionResponse']]
+
+SEARCH_RESULTS = util.nspath_eval('csw:SearchResults', namespaces)
+
+# bytes of a streamed response kept for the XML viewer
+RESPONSE_LIMIT = 1048576
+
+
+def request_key(url, constraints, startposition=0, maxrecords=10,
+                esn='full'):
+    """return a hashable key identifying a GetRecords request"""
+
+    if constraints:
+        flt = etree.tostring(fes.FilterRequest().setConstraintList(
+            constraints))
+    else:
+        flt = ''
+
+    return canonical_url(url), flt, startposition, maxrecords, esn
+
+
+def operation_key(operation, url, **kwargs):
+    """
+    return a hashable key identifying a CSW request; identical requests
+    running at the same time can share one response
+    """
+
+    if operation == 'getrecords':
+        return request_key(url, kwargs.get('constraints'),
+                           kwargs.get('startposition', 0),
+                           kwargs.get('maxrecords', 10),
+                           kwargs.get('esn', 'summary')) + \
+            (kwargs.get('resulttype', 'results'),)
+
+    return (operation, canonical_url(url),
+            tuple(sorted([(name, repr(value))
+                          for name, value in kwargs.items()])))
+
+
+class CatalogueClient(CatalogueServiceWeb):
+    """owslib.csw.CatalogueServiceWeb which can reuse cached capabilities"""
+
+    def __init__(self, url, capabilities_cache=None, no_cache=False,
+                 **kwargs):
+        """
+        capabilities_cache is a cache.CapabilitiesCache; when it holds a
+        fresh document for url, no GetCapabilities request is sent.  With
+        no_cache, GetCapabilities always reaches the service: neither
+        capabilities_cache nor the HTTP cache answer it, and its response
+        refreshes capabilities_cache
+        """
+
+        self.capabilities_cache = capabilities_cache
+        self.capabilities_cached = False
+
+        if no_cache and not kwargs.get('skip_caps'):
+            kwargs['skip_caps'] = True
+            CatalogueServiceWeb.__init__(self, url, **kwargs)
+            self._get_capabilities()
+            if capabilities_cache is not None:
+                capabilities_cache.put(url, self.response)
+            return
+
+        cached = None
+        if capabilities_cache is not None and not kwargs.get('skip_caps'):
+            cached = capabilities_cache.get(url)
+
+        if cached is None:
+            CatalogueServiceWeb.__init__(self, url, **kwargs)
+            if all([capabilities_cache is not None,
+                    not kwargs.get('skip_caps'),
+                    self.exceptionreport is None]):
+                capabilities_cache.put(url, self.response)
+            return
+
+        LOGGER.debug('Using cached capabilities for %s', url)
+        kwargs['skip_caps'] = True
+        CatalogueServiceWeb.__init__(self, url, **kwargs)
+
+        data = {'service': self.service, 'version': self.version,
+                'request': 'GetCapabilities'}
+        self.request = '%s%s' % (util.bind_url(self.url), urlencode(data))
+        self.response = cached
+        self._exml = etree.parse(StringIO(cached))
+        self._parse_capabilities()
+        self.capabilities_cached = True
+
+    def service_version(self):
+        """
+        return the CSW version the service reports in its capabilities;
+        self.version is the one requested
+        """
+
+        version = self._exml.getroot().get('version')
+        if not version:
+            version = getattr(self.identification, 'version', None)
+        return version or self.version
+
+    def _get_capabilities(self):
+        """send GetCapabilities past the HTTP cache"""
+
+        data = {'service': self.service, 'version': self.version,
+                'request': 'GetCapabilities'}
+        self.request = '%s%s' % (util.bind_url(self.url), urlencode(data))
+
+        req = Request(self.request)
+        req.add_header('Cache-Control', 'no-cache')
+        req.add_header('Pragma', 'no-cache')
+        self._add_credentials(req)
+        self.response = urlopen(req, timeout=self.timeout).read()
+
+        self._exml = etree.parse(StringIO(self.response))
+        if self._exml.getroot().tag not in CSW_RESPONSES:
+            raise RuntimeError('Document is XML, but not CSW-ish')
+
+        val = self._exml.find(util.nspath_eval('ows:Exception', namespaces))
+        if val is not None:
+            raise ows.ExceptionReport(self._exml, self.owscommon.namespace)
+        self.exceptionreport = None
+        self._parse_capabilities()
+
+    def _add_credentials(self, req):
+        """add HTTP basic authentication to req, if configured"""
+
+        if self.username is not None and self.password is not None:
+            credentials = base64.encodestring(
+                '%s:%s' % (self.username, self.password))[:-1]
+            req.add_header('Authorization', 'Basic %s' % credentials)
+
+    def getrecords2(self, record_callback=None, **kwargs):
+        """
+        as owslib.csw.CatalogueServiceWeb.getrecords2; when record_callback
+        is given, Dublin Core responses are parsed while they download and
+        record_callback is called with each CswRecord as soon as it is
+        complete
+        """
+
+        outputschema = kwargs.get('outputschema', namespaces['csw'])
+        if record_callback is None or outputschema != namespaces['csw']:
+            return CatalogueServiceWeb.getrecords2(self, **kwargs)
+
+        self.record_callback = record_callback
+        self.record_tag = util.nspath_eval(
+            'csw:%s' % self._setesnel(kwargs.get('esn', 'summary')),
+            namespaces)
+        self.streamed_records = OrderedDict()
+
+        # only this request is streamed
+        self._invoke = self._invoke_streaming
+        try:
+            CatalogueServiceWeb.getrecords2(self, **kwargs)
+        finally:
+            del self._invoke
+            self.record_callback = None
+
+        if self.exceptionreport is None:
+            self.records = self.streamed_records
+        self.streamed_records = None
+
+    def _invoke_streaming(self):
+        """POST self.request and parse records as the response arrives"""
+
+        self.request = cleanup_namespaces(self.request)
+        # declare the prefixes used in typeNames, as getrecords2 does
+        for query in self.request.findall(util.nspath_eval('csw:Query',
+                                                           namespaces)):
+            typenames = query.get('typeNames')
+            if typenames is not None:
+                self.request = add_namespaces(
+                    self.request,
+                    [typename.split(':')[0]
+                     for typename in typenames.split(' ')])
+        self.request = util.element_to_string(self.request, encoding='utf-8')
+
+        req = Request(self._post_url('GetRecords'), self.request)
+        req.add_header('Content-Type', 'text/xml')
+        req.add_header('Accept', 'text/xml')
+        req.add_header('Accept-Language', self.lang)
+        self._add_credentials(req)
+
+        source = RecordingReader(urlopen(req, timeout=self.timeout),
+                                 RESPONSE_LIMIT)
+
+        root = None
+        container = None
+        for event, elem in etree.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                elif elem.tag == SEARCH_RESULTS:
+                    container = elem
+            elif elem.tag == self.record_tag and container is not None:
+                record = CswRecord(elem)
+                identifier = self._setidentifierkey(record.identifier)
+                self.streamed_records[identifier] = record
+                self.record_callback(record)
+                # drop parsed records so the tree only keeps the results
+                # envelope, which getrecords2 still reads
+                container.remove(elem)
+
+        self.response = source.getvalue()
+        self._exml = etree.ElementTree(root)
+
+        if root is None or root.tag not in CSW_RESPONSES:
+            raise RuntimeError('Document is XML, but not CSW-ish')
+
+        val = self._exml.find(util.nspath_eval('ows:Exception', namespaces))
+        if val is not None:
+            raise ows.ExceptionReport(self._exml, self.owscommon.namespace)
+        self.exceptionreport = None
+
+    def _post_url(self, operation):
+        """
+        return the POST URL advertised for operation, preferring one
+        whose PostEncoding constraint allows XML, as OWSLib does
+        """
+
+        try:
+            methods = self.get_operation_by_name(operation).methods
+        except (AttributeError, KeyError):  # skip_caps or not advertised
+            return self.url
+
+        posts = [method for method in methods
+                 if (method.get('type') or '').lower() == 'post']
+        for method in posts:
+            for constraint in method.get('constraints') or []:
+                if all([(constraint.name or '').lower() == 'postencoding',
+                        'xml' in [(value or '').lower()
+                                  for value in constraint.values]]):
+                    return method.get('url') or self.url
+        if posts:
+            return posts[0].get('url') or self.url
+        return self.url
+
+    def _parse_capabilities(self):
+        """populate service metadata from the capabilities in self._exml"""
+
+        val = self._exml.find(util.nspath_eval('ows:ServiceIdentification',
+                                               namespaces))
+        self.identification = ows.ServiceIdentification(
+            val, self.owscommon.namespace)
+
+        val = self._exml.find(util.nspath_eval('ows:ServiceProvider',
+                                               namespaces))
+        self.provider = ows.ServiceProvider(val, self.owscommon.namespace)
+
+        self.operations = []
+        for elem in self._exml.findall(util.nspath_eval(
+                'ows:OperationsMetadata/ows:Operation', namespaces)):
+            self.operations.append(
+                ows.OperationsMetadata(elem, self.owscommon.namespace))
+
+        val = self._exml.find(util.nspath_eval('ogc:Filter_Capabilities',
+                                               namespaces))
+        self.filters = fes.FilterCapabilities(val)
+
+
+class RecordingReader(object):
+    """
+    file-like wrapper which keeps a copy of the first limit bytes read;
+    getvalue marks a copy cut short with an XML comment
+    """
+
+    def __init__(self, fileobj, limit=None):
+        self.fileobj = fileobj
+        self.limit = limit
+        self.chunks = []
+        self.size = 0
+        self.kept = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.size += len(data)
+        if self.limit is None:
+            self.chunks.append(data)
+        elif self.kept < self.limit:
+            self.chunks.append(data[:self.limit - self.kept])
+            self.kept += len(self.chunks[-1])
+        return data
+
+    def getvalue(self):
+        value = ''.join(self.chunks)
+        if len(value) < self.size:
+            value += '\n<!-- response truncated: %d of %d bytes -->' % (
+                len(value), self.size)
+        return value
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# CSW Client
+# ---------------------------------------------------------
+# QGIS Catalogue Service client.
+#
+# Copyright (C) 2010 NextGIS (http://nextgis.org),
+#                    Alexander Bruy (alexander.bruy@gmail.com),
+#                    Maxim Dubinin (sim@gis-lab.info)
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+###############################################################################
+
+from PyQt4.QtCore import QSettings, Qt
+from PyQt4.QtGui import QDialog, QListWidgetItem
+
+from MetaSearch_geocode.util import get_ui_class
+
+BASE_CLASS = get_ui_class('federateddialog.ui')
+
+
+class FederatedDialog(QDialog, BASE_CLASS):
+    """choose the catalogues queried by a federated search"""
+    def __init__(self):
+        """init"""
+
+        QDialog.__init__(self)
+        self.setupUi(self)
+        self.settings = QSettings()
+        self.populate()
+
+    def populate(self):
+        """list connections, checking those already selected"""
+
+        self.settings.beginGroup('/MetaSearch/')
+        keys = self.settings.childGroups()
+        self.settings.endGroup()
+
+        for key in keys:
+            item = QListWidgetItem(self.listConnections)
+            item.setText(key)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            if self.settings.value('/MetaSearch/%s/federated' % key,
+                                   False, bool):
+                item.setCheckState(Qt.Checked)
+            else:
+                item.setCheckState(Qt.Unchecked)
+
+        self.spnConcurrency.setValue(
+            self.settings.value('/MetaSearch/federated_concurrency', 4, int))
+
+    def accept(self):
+        """save selection"""
+
+        for row in range(self.listConnections.count()):
+            item = self.listConnections.item(row)
+            self.settings.setValue('/MetaSearch/%s/federated' % item.text(),
+                                   item.checkState() == Qt.Checked)
+
+        self.settings.setValue('/MetaSearch/federated_concurrency',
+                               self.spnConcurrency.value())
+
+        QDialog.accept(self)
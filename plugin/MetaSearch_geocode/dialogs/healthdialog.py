@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# CSW Client
+# ---------------------------------------------------------
+# QGIS Catalogue Service client.
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+###############################################################################
+
+
+from PyQt4.QtCore import QSettings, Qt
+from PyQt4.QtGui import QDialog, QMessageBox, QTableWidgetItem
+
+from MetaSearch_geocode.health import EndpointHealth
+from MetaSearch_geocode.util import get_ui_class
+from MetaSearch_geocode.workers import FederatedSearch
+
+BASE_CLASS = get_ui_class('healthdialog.ui')
+
+# columns of tableConnections
+SERVICE, STATUS, LATENCY, AVERAGE, VERSION, SIZE, HISTORY = range(7)
+
+SPARKS = u'▁▂▃▄▅▆▇█'
+FAILED = u'×'
+
+
+def sparkline(history):
+    """return a latency history as a line of bar characters"""
+
+    latencies = [value for value in history if value is not None]
+    if not latencies:
+        return FAILED * len(history)
+
+    low = min(latencies)
+    step = float(max(latencies) - low) / (len(SPARKS) - 1) or 1
+    return u''.join([FAILED if value is None else
+                     SPARKS[int((value - low) / step)]
+                     for value in history])
+
+
+class HealthDialog(QDialog, BASE_CLASS):
+    """probe all connections with GetCapabilities at the same time"""
+    def __init__(self, owner=None, timeout=10, capabilities_cache=None):
+        """
+        each service is given timeout seconds to answer; fresh capabilities
+        are stored in capabilities_cache.  Requests still running when the
+        dialog closes are left to finish as children of owner
+        """
+
+        QDialog.__init__(self)
+        self.setupUi(self)
+        self.settings = QSettings()
+        self.timeout = timeout
+        self.capabilities_cache = capabilities_cache
+        self.items = {}
+
+        # the caches are bypassed: the point is to reach the services
+        self.probe = FederatedSearch(
+            owner, None,
+            self.settings.value('/MetaSearch/healthcheck_concurrency', 8,
+                                int))
+        self.probe.resultsReady.connect(self.probe_results)
+        self.probe.error.connect(self.probe_error)
+        self.probe.done.connect(self.probe_done)
+
+        self.btnCheck.clicked.connect(self.check)
+        self.btnDelete.clicked.connect(self.delete_connections)
+
+        self.populate()
+
+    def connections(self):
+        """return the names of all connections"""
+
+        self.settings.beginGroup('/MetaSearch/')
+        keys = self.settings.childGroups()
+        self.settings.endGroup()
+        return keys
+
+    def populate(self):
+        """list connections with their statistics so far"""
+
+        self.tableConnections.setSortingEnabled(False)
+        self.tableConnections.setRowCount(0)
+        self.items = {}
+
+        for key in self.connections():
+            row = self.tableConnections.rowCount()
+            self.tableConnections.insertRow(row)
+            item = QTableWidgetItem(key)
+            item.setToolTip(self.settings.value('/MetaSearch/%s/url' % key))
+            self.tableConnections.setItem(row, SERVICE, item)
+            for column in range(STATUS, HISTORY + 1):
+                self.tableConnections.setItem(row, column,
+                                              QTableWidgetItem())
+            self.items[key] = item
+
+            health = EndpointHealth(self.settings, key)
+            if health.consecutive:
+                self.set_status(key, self.tr('Failed: %s') %
+                                health.last_error)
+            self.update_row(key, health)
+
+        self.tableConnections.setSortingEnabled(True)
+        self.tableConnections.resizeColumnsToContents()
+
+    def cell(self, name, column):
+        """return the item of a connection in column"""
+
+        row = self.items[name].row()
+        return self.tableConnections.item(row, column)
+
+    def set_status(self, name, text):
+        self.cell(name, STATUS).setText(text)
+
+    def update_row(self, name, health, latency=None, version=None,
+                   size=None):
+        """show the statistics of a connection and a probe result"""
+
+        self.tableConnections.setSortingEnabled(False)
+        for column, value in [(LATENCY, latency), (VERSION, version),
+                              (SIZE, size)]:
+            if value is not None:
+                self.cell(name, column).setData(Qt.DisplayRole, value)
+        if health.successes:
+            self.cell(name, AVERAGE).setData(
+                Qt.DisplayRole, int(round(health.latency * 1000)))
+
+        history = self.cell(name, HISTORY)
+        history.setText(sparkline(health.history))
+        history.setToolTip(u' '.join([FAILED if value is None else
+                                      unicode(value)
+                                      for value in health.history]))
+        self.tableConnections.setSortingEnabled(True)
+
+    def check(self):
+        """send GetCapabilities to every connection"""
+
+        connections = []
+        for key in self.connections():
+            url = self.settings.value('/MetaSearch/%s/url' % key)
+            if not url or key not in self.items:
+                continue
+            connections.append((key, url, None))
+            self.set_status(key, self.tr('Checking...'))
+            for column in [LATENCY, VERSION, SIZE]:
+                self.cell(key, column).setData(Qt.DisplayRole, None)
+
+        if not connections:
+            return
+
+        self.btnCheck.setEnabled(False)
+        self.btnDelete.setEnabled(False)
+        self.probe.start(connections, self.timeout, operation='capabilities',
+                         no_cache=True)
+
+    def probe_results(self, name, catalog, worker_timing):
+        """show the answer of a connection"""
+
+        health = EndpointHealth(self.settings, name)
+        health.record_success(worker_timing.elapsed())
+
+        if self.capabilities_cache is not None:
+            self.capabilities_cache.put(catalog.url, catalog.response)
+
+        self.set_status(name, self.tr('OK'))
+        self.update_row(name, health,
+                        int(round(worker_timing.elapsed() * 1000)),
+                        catalog.service_version(), len(catalog.response))
+
+    def probe_error(self, name, stage, err, worker_timing):
+        """show why a connection failed to answer"""
+
+        health = EndpointHealth(self.settings, name)
+        health.record_error(stage, err)
+
+        if stage == 'timeout':
+            self.set_status(name, self.tr('Timed out after %d s') %
+                            self.timeout)
+        else:
+            self.set_status(name, self.tr('Failed: %s') % err)
+        latency = None
+        if worker_timing is not None:
+            latency = int(round(worker_timing.elapsed() * 1000))
+        self.update_row(name, health, latency)
+
+    def probe_done(self):
+        self.btnCheck.setEnabled(True)
+        self.btnDelete.setEnabled(True)
+
+    def delete_connections(self):
+        """remove the selected connections"""
+
+        rows = set([index.row() for index in
+                    self.tableConnections.selectedIndexes()])
+        names = [self.tableConnections.item(row, SERVICE).text()
+                 for row in sorted(rows)]
+        if not names:
+            return
+
+        msg = self.tr('Remove services %s?') % ', '.join(names)
+        result = QMessageBox.information(self, self.tr('Confirm delete'), msg,
+                                         QMessageBox.Ok | QMessageBox.Cancel)
+        if result != QMessageBox.Ok:
+            return
+
+        for name in names:
+            key = '/MetaSearch/%s' % name
+            url = self.settings.value('%s/url' % key)
+            if url and self.capabilities_cache is not None:
+                self.capabilities_cache.invalidate(url)
+            self.settings.remove(key)
+
+        self.populate()
+
+    def reject(self):
+        """abandon outstanding requests"""
+
+        self.probe.stop()
+        QDialog.reject(self)
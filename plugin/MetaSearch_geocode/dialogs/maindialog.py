@@ -29,22 +29,26 @@
 ###############################################################################
 # endregion
 
+from collections import deque
+from functools import partial
+import logging
 import os.path
 import json
 import time
-from urllib2 import build_opener, install_opener, ProxyHandler
 
-from PyQt4.QtCore import QSettings, Qt, SIGNAL, SLOT, QThread, pyqtSignal, pyqtSlot, QObject, QMetaObject, Q_ARG, QMutex
-from PyQt4.QtGui import (QApplication, QColor, QCursor, QDialog,
-                         QDialogButtonBox, QMessageBox, QTreeWidgetItem,
-                         QWidget, QCompleter)
+from PyQt4.QtCore import (QSettings, Qt, SIGNAL, SLOT, QThread,
+                          pyqtSignal, pyqtSlot, QObject, QMetaObject,
+                          Q_ARG, QMutex, QTimer, QWaitCondition)
+from PyQt4.QtGui import (QApplication, QColor, QDialog,
+                         QDialogButtonBox, QMessageBox, QProgressBar,
+                         QTreeWidgetItem, QWidget, QCompleter,
+                         QStringListModel)
 
-from qgis.core import (QgsApplication, QgsCoordinateReferenceSystem,
+from qgis.core import (QGis, QgsApplication, QgsCoordinateReferenceSystem,
                        QgsCoordinateTransform, QgsGeometry, QgsPoint,
                        QgsProviderRegistry)
 from qgis.gui import QgsRubberBand
 
-from owslib.csw import CatalogueServiceWeb
 from owslib.fes import BBox, PropertyIsLike
 from owslib.ows import ExceptionReport
 from owslib.wcs import WebCoverageService
@@ -52,63 +56,102 @@ from owslib.wfs import WebFeatureService
 from owslib.wms import WebMapService
 from owslib.wmts import WebMapTileService
 
-from MetaSearch_geocode import link_types
+from MetaSearch_geocode import link_types, timing, transport
+from MetaSearch_geocode.cache import (CapabilitiesCache, GeocodeCache,
+                                      HTTPCache, PageCache, RecordCache)
+from MetaSearch_geocode.catalogue import operation_key, request_key
+from MetaSearch_geocode.dialogs.federateddialog import FederatedDialog
+from MetaSearch_geocode.dialogs.healthdialog import HealthDialog
 from MetaSearch_geocode.dialogs.manageconnectionsdialog import ManageConnectionsDialog
 from MetaSearch_geocode.dialogs.newconnectiondialog import NewConnectionDialog
 from MetaSearch_geocode.dialogs.recorddialog import RecordDialog
 from MetaSearch_geocode.dialogs.xmldialog import XMLDialog
-from MetaSearch_geocode.util import (get_connections_from_file, get_ui_class,
+from MetaSearch_geocode.gazetteer import (GazetteerIndex, PlaceTrie,
+                                          load_gazetteer)
+from MetaSearch_geocode.geocoders import get_provider, race
+from MetaSearch_geocode.health import connection_name, EndpointHealth
+from MetaSearch_geocode.store import RecordStore
+from MetaSearch_geocode.util import (get_cache_dir,
+                                     get_connections_from_file, get_ui_class,
                                      highlight_xml, normalize_text, open_url,
                                      render_template, StaticContext)
-
-from geopy.geocoders import Nominatim, GoogleV3
-from geopy.exc import *
+from MetaSearch_geocode.workers import (CSW_Worker, FederatedSearch,
+                                        Harvest_Worker)
 
 BASE_CLASS = get_ui_class('maindialog.ui')
 
+LOGGER = logging.getLogger('MetaSearch(Geocode)')
 
-class GeoCoder_Worker(QThread):
-    finished = pyqtSignal(bool)
-    dataReady = pyqtSignal(dict)
-    error = pyqtSignal(object)
 
-    def __init__(self, parent=None, api_key=None):
+class GeoCoder_Worker(QThread):
+    """
+    long-lived geocoder serving a queue of lookups. Only the latest
+    lookup is answered: older queued ones are dropped, and a running one
+    is abandoned once a newer one is requested. Each lookup races several
+    providers; the first usable answer is emitted, later ones are merged
+    into it. delayed is emitted when nothing usable came within the
+    budget, error only once every provider has failed. Signals carry the
+    query they answer
+    """
+
+    dataReady = pyqtSignal(object, dict)
+    delayed = pyqtSignal(object)
+    error = pyqtSignal(object, object)
+
+    def __init__(self, parent=None):
         super(GeoCoder_Worker, self).__init__(parent)
 
         self.mutex = QMutex()
-        self._api_key = api_key
-        self.query = ""
+        self.condition = QWaitCondition()
+        self.requests = deque()
+        self.generation = 0
         self.stopped = False
-        self.completed = False
-        self.geocoder = self.get_geocoder("googlev3")
-        self.data = {}
+        self.config = None
+        self.configured = None
+        self.providers = []
+        self.budget = 3
+
+    def configure(self, api_key, providers, index=None, budget=3,
+                  timeout=10):
+        """
+        set the providers raced by the next lookups; budget is the number
+        of seconds a first answer is waited for, timeout the number of
+        seconds a provider may take to answer at all
+        """
 
-    @property
-    def api_key(self):
-        return self._api_key
+        try:
+            self.mutex.lock()
+            self.config = (api_key or None, tuple(providers), index, budget,
+                           timeout)
+        finally:
+            self.mutex.unlock()
 
-    @api_key.setter
-    def api_key(self, api_key):
-        self._api_key = api_key
+    def request(self, query):
+        """queue a lookup of query, superseding all earlier ones"""
 
-    def initialize(self, query):
-        self.query = query
+        try:
+            self.mutex.lock()
+            self.requests.append(query)
+            self.generation += 1
+            self.condition.wakeOne()
+        finally:
+            self.mutex.unlock()
 
-    def get_geocoder(self, geocoder_name):
-        if geocoder_name == "googlev3":
-            if self.api_key == "":
-                self.api_key = None
-            return GoogleV3(api_key=self.api_key)
+    def cancel(self):
+        """drop the queued lookups and abandon the running one"""
 
-    def run(self):
-            self.geocode()
-            self.stop()
-            self.finished.emit(self.completed)
+        try:
+            self.mutex.lock()
+            self.requests.clear()
+            self.generation += 1
+        finally:
+            self.mutex.unlock()
 
     def stop(self):
         try:
             self.mutex.lock()
             self.stopped = True
+            self.condition.wakeOne()
         finally:
             self.mutex.unlock()
 
@@ -119,41 +162,87 @@ class GeoCoder_Worker(QThread):
         finally:
             self.mutex.unlock()
 
-    def geocode(self):
-        print('worker thread id: {0}\t\tApi Key: {1}'.format(int(QThread.currentThreadId()), self.api_key))
-        self.data = {}
-        if type(self.geocoder) is GoogleV3:
+    def isStale(self, generation):
+        """return whether the lookup of generation has been superseded"""
+
+        try:
+            self.mutex.lock()
+            return self.stopped or generation != self.generation
+        finally:
+            self.mutex.unlock()
+
+    def run(self):
+        while True:
             try:
-                response = self.geocoder.geocode(self.query, exactly_one=False)
-                # List of geopy.Locations -> dict
-                if type(response) is list:
-                    for location in response:
-                        self.data[location.address] = self._geolocator_to_bbox(location.raw)
-                else:
-                    self.data[response.address] = self._geolocator_to_bbox(response.raw)
-            except (ConfigurationError, GeocoderAuthenticationFailure, GeocoderInsufficientPrivileges,
-                    GeocoderNotFound, GeocoderParseError, GeocoderQueryError, GeocoderQuotaExceeded,
-                    GeocoderServiceError, GeocoderTimedOut, GeocoderUnavailable, GeopyError) as e:
-                self.error.emit(e.__class__.__name__)
-
-            except BaseException as e:
-                self.error.emit(e.__class__.__name__)
-        self.dataReady.emit(self.data)
-        self.completed = True
-        # print(data)
-
-    def _geolocator_to_bbox(self, response):
-        """Parses the geolocation service's respond as ullr"""
-        maxx = maxy = minx = miny = float
-        if type(self.geocoder) is GoogleV3:
-            if u'bounds' in response[u'geometry']:
-                maxy = float(response[u"geometry"][u"bounds"][u"northeast"][u"lat"])
-                maxx = float(response[u"geometry"][u"bounds"][u"northeast"][u"lng"])
-                miny = float(response[u"geometry"][u"bounds"][u"southwest"][u"lat"])
-                minx = float(response[u"geometry"][u"bounds"][u"southwest"][u"lng"])
-            return maxx, maxy, minx, miny
-        # Sometimes the geolocator returns POIs of interest without bbox
-        return maxx, maxy, minx, miny
+                self.mutex.lock()
+                while not self.requests and not self.stopped:
+                    self.condition.wait(self.mutex)
+                if self.stopped:
+                    return
+                query = self.requests.pop()
+                if self.requests:
+                    LOGGER.debug('Dropping %d stale geocoding lookups',
+                                 len(self.requests))
+                    self.requests.clear()
+                generation = self.generation
+                config = self.config
+            finally:
+                self.mutex.unlock()
+
+            if config != self.configured:
+                self.get_geocoders(config)
+            self.geocode(query, partial(self.isStale, generation))
+
+    def get_geocoders(self, config):
+        """build the providers of config; they are kept between lookups"""
+
+        api_key, names, index, self.budget, timeout = config
+        self.providers = [provider for provider in
+                          [get_provider(name, api_key, timeout, index)
+                           for name in names]
+                          if provider is not None]
+        self.configured = config
+
+    def geocode(self, query, stale):
+        if stale():  # superseded before it was sent
+            return
+
+        # on conflicting addresses the provider listed first wins
+        ranks = dict([(provider, rank) for rank, provider in
+                      enumerate(self.providers)])
+        owners = {}
+        data = {}
+        errors = []
+        for provider, locations, err in race(self.providers, query,
+                                             self.budget, stale):
+            if provider is None:  # over budget, late answers still follow
+                if not data and not stale():
+                    self.delayed.emit(query)
+                continue
+            if err is not None:
+                LOGGER.debug('Geocoder %s failed on %s: %s', provider.name,
+                             query, err)
+                errors.append(err)
+                continue
+            if not locations:
+                continue
+            for address, bbox in locations.items():
+                if ranks[provider] < owners.get(address, len(ranks)):
+                    owners[address] = ranks[provider]
+                    data[address] = bbox
+            if not stale():
+                self.dataReady.emit(query, dict(data))
+
+        # the requests cannot be interrupted, a stale response is dropped
+        if stale():
+            LOGGER.debug('Discarding geocode of stale query %s', query)
+            return
+
+        if not data:
+            if errors and len(errors) == len(self.providers):
+                self.error.emit(query, errors[0].__class__.__name__)
+            else:
+                self.dataReady.emit(query, data)
 
 
 class MetaSearchDialog(QDialog, BASE_CLASS):
@@ -171,9 +260,68 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
         self.catalog = None
         self.catalog_url = None
         self.context = StaticContext()
+        self.csw_worker = None
+        self.csw_workers = set()
+        self.results_text = None
+        self.capabilities_cache = CapabilitiesCache(
+            get_cache_dir('capabilities'),
+            self.settings.value('/MetaSearch/capabilities_ttl', 86400, int))
+        self.http_cache = HTTPCache(
+            get_cache_dir('http'),
+            self.settings.value('/MetaSearch/http_cache_size', 50, int) *
+            1024 * 1024)
+        self.page_cache = PageCache()
+        # match counts of queries, keyed like pages with esn 'hits'
+        self.count_cache = PageCache(200)
+        self.count_worker = None
+        self.prefetch_worker = None
+        self.prefetch_pending = None
+        self.federated = None
+        self.federated_catalogs = {}
+        self.record_store = RecordStore(
+            os.path.join(get_cache_dir('records'), 'records.db'))
+        self.local_query = None
+        self.harvesters = {}
+        self.harvest_items = {}
+        self.record_cache = RecordCache(
+            get_cache_dir('metadata'),
+            self.settings.value('/MetaSearch/record_cache_size', 200, int))
+        self.geocode_cache = GeocodeCache(
+            get_cache_dir('geocode'),
+            self.settings.value('/MetaSearch/geocode_cache_size', 500, int),
+            self.settings.value('/MetaSearch/geocode_cache_ttl', 2592000,
+                                int))
+        self.full_pending = {}
+        self.full_requested = set()
+        # (url, identifier) of records GetRecordById did not return
+        self.full_missing = set()
+        self.metadata_pending = None
+        self.timing = None
+        self.records = {}
+        self.streamed = 0
         self.LayerDic = {}
         self.Locations = {}
 
+        # full records selected in quick succession are fetched together
+        self.full_timer = QTimer(self)
+        self.full_timer.setSingleShot(True)
+        self.full_timer.setInterval(200)
+        self.full_timer.timeout.connect(self.fetch_full_records)
+
+        # matches are counted once the query has not changed for a while
+        self.count_timer = QTimer(self)
+        self.count_timer.setSingleShot(True)
+        self.count_timer.setInterval(
+            self.settings.value('/MetaSearch/count_delay', 600, int))
+        self.count_timer.timeout.connect(self.count_matches)
+
+        # locations are geocoded once typing in leWhere pauses
+        self.geocode_timer = QTimer(self)
+        self.geocode_timer.setSingleShot(True)
+        self.geocode_timer.setInterval(
+            self.settings.value('/MetaSearch/geocode_delay', 400, int))
+        self.geocode_timer.timeout.connect(self.geocode_location)
+
         # CSW Footprint
         self.rubber_band = QgsRubberBand(self.map, True)  # True = a polygon
         self.rubber_band.setColor(QColor(255, 0, 0, 75))
@@ -191,6 +339,10 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
         self.btnServerInfo.clicked.connect(self.connection_info)
         self.btnAddDefault.clicked.connect(self.add_default_connections)
         self.btnCapabilities.clicked.connect(self.show_xml)
+        self.btnRefreshCapabilities.clicked.connect(self.refresh_capabilities)
+        self.btnCheckConnections.clicked.connect(self.check_connections)
+        self.btnHarvest.clicked.connect(self.harvest)
+        self.btnStopHarvest.clicked.connect(self.stop_harvest)
         self.tabWidget.currentChanged.connect(self.populate_connection_list)
 
         # server management buttons
@@ -205,6 +357,17 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
         self.treeRecords.itemDoubleClicked.connect(self.show_metadata)
         self.btnSearch.clicked.connect(self.search)
         self.leKeywords.returnPressed.connect(self.search)
+        self.btnCancel.clicked.connect(self.cancel_csw)
+        self.btnFederated.clicked.connect(self.select_federated)
+        # only edits by the user trigger a count
+        for line_edit in [self.leKeywords, self.leNorth, self.leSouth,
+                          self.leEast, self.leWest]:
+            line_edit.textEdited.connect(self.schedule_count)
+        for button in [self.btnCanvasBbox, self.btnGlobalBbox]:
+            button.clicked.connect(self.schedule_count)
+        self.cmbConnectionsSearch.activated.connect(self.schedule_count)
+        self.cbLocal.clicked.connect(self.schedule_count)
+        self.cbFederated.clicked.connect(self.schedule_count)
         # prevent dialog from closing upon pressing enter
         self.buttonBox.button(QDialogButtonBox.Close).setAutoDefault(False)
         # launch help from button
@@ -217,9 +380,20 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
         # Reverse Geocode
         self.leApiKey.editingFinished.connect(self.save_api_key)
         self.geocoder = GeoCoder_Worker(self)
-        self.geocoder.dataReady.connect(self.populate_autocomplete)
+        self.geocoder.dataReady.connect(self.geocoder_ready)
+        self.geocoder.delayed.connect(self.geocoder_delayed)
         self.geocoder.error.connect(self.geocoder_error)
-        self.geocoder.error.connect(self.mPrint)
+        self.geocoder.start()
+        # latest query sent to the geocoder, and the cache key of its results
+        self.geocode_query = None
+        self.geocode_key = None
+        self.gazetteer = self.open_gazetteer()
+        self.place_index = PlaceTrie()
+        self.load_place_index()
+        self.location_model = QStringListModel(self)
+        completer = QCompleter(self.location_model, self)
+        completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.leWhere.setCompleter(completer)
         self.leWhere.textEdited.connect(self.get_locations)
 
         # Layer List
@@ -235,6 +409,7 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
         self.btnAddToWfs.clicked.connect(self.add_to_ows)
         self.btnAddToWcs.clicked.connect(self.add_to_ows)
         self.btnShowXml.clicked.connect(self.show_xml)
+        self.btnTimings.clicked.connect(self.show_timings)
 
         # Misc
         self.map.layersChanged.connect(self.populate_layer_list)
@@ -252,21 +427,110 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
         # Call the 'real' show
         super(MetaSearchDialog, self).show()
 
-    def mPrint(self, str):
-        print "hiho"
+    def load_place_index(self):
+        """index the places resolved before and those of the gazetteer"""
+
+        for query, locations in self.geocode_cache.items():
+            self.place_index.add_locations(locations, query)
+
+        gazetteer = self.settings.value('/MetaSearch/gazetteer', '')
+        if gazetteer:
+            try:
+                load_gazetteer(self.place_index, gazetteer)
+            except (IOError, OSError), err:
+                LOGGER.warning('Cannot read gazetteer %s: %s', gazetteer, err)
+
+    def open_gazetteer(self):
+        """return the offline gazetteer index, or None"""
+
+        filename = self.settings.value('/MetaSearch/gazetteer_index', '')
+        if not filename:
+            return None
+        try:
+            return GazetteerIndex(filename)
+        except (IOError, OSError, ValueError), err:
+            LOGGER.warning('Cannot open gazetteer index %s: %s', filename,
+                           err)
+            return None
+
+    def geocoder_providers(self):
+        """
+        return the names of the geocoding providers to race, the one
+        selected in the Settings tab first
+        """
+
+        names = [name.strip() for name in self.settings.value(
+            '/MetaSearch/geocoders', 'googlev3,nominatim').split(',')
+            if name.strip()]
+        if self.gazetteer is None and 'gazetteer' in names:
+            names.remove('gazetteer')
+
+        preferred = 'googlev3'
+        if self.rbGeolocationService_OSM.isChecked():
+            preferred = 'nominatim'
+        if preferred in names:
+            names.remove(preferred)
+        names.insert(0, preferred)
+        return names
 
     def get_locations(self, location):
-        """ Geolocates a location"""
+        """
+        suggest the known places starting with location; geolocate it
+        once the user stops typing if none is known
+        """
+
+        self.stop_geocoder()
+        self.geocode_timer.stop()
+
+        locations = self.place_index.complete(location) if location else {}
+        if (not locations and self.gazetteer is not None and
+                len(location) >= 3):
+            locations = self.gazetteer.geocode(location)
+        self.populate_autocomplete(locations)
+        if not locations and len(location) > 3:
+            self.geocode_timer.start()
+
+    def geocode_location(self):
+        """geocode the text of leWhere; only its latest query is answered"""
+
+        location = self.leWhere.text()
+        if len(location) <= 3:
+            return
+
+        self.stop_geocoder()
+        self.leWhere.setToolTip('')
+
+        # places looked up before cost no request, nor quota
+        providers = self.geocoder_providers()
+        locations = self.geocode_cache.get('+'.join(providers), location)
+        if locations is not None:
+            self.populate_autocomplete(locations)
+            return
 
-        api_key = self.settings.value('/MetaSearch/api_key')
-        self.geocoder.api_key = api_key
-        if len(location) > 3:
-            if self.geocoder.isRunning():
-                self.geocoder.terminate()
-            self.geocoder.initialize(location)
-            self.geocoder.start()
+        self.geocoder.configure(
+            self.settings.value('/MetaSearch/api_key'), providers,
+            self.gazetteer,
+            self.settings.value('/MetaSearch/geocode_budget', 3000, int) /
+            1000.0,
+            self.settings.value('/MetaSearch/geocode_timeout', 10000, int) /
+            1000.0)
+        self.geocode_query = location
+        self.geocode_key = '+'.join(providers)
+        self.geocoder.request(location)
 
-        return
+    def stop_geocoder(self):
+        """abandon the running geocode, if any"""
+
+        if self.geocode_query is not None:
+            # the request runs to its end, then the worker drops the response
+            self.geocoder.cancel()
+            self.geocode_query = None
+
+    def shutdown(self):
+        """stop the geocoder thread"""
+
+        self.geocoder.stop()
+        self.geocoder.wait()
 
     def manageGui(self):
         """open window"""
@@ -282,7 +546,6 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
 
         api_key = '/MetaSearch/api_key'
         self.leApiKey.setText(self.settings.value(api_key))
-        self.geocoder.api_key = api_key
 
         self.set_bbox_global()
 
@@ -338,6 +601,9 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
             state_disabled = True
 
         self.btnServerInfo.setEnabled(state_disabled)
+        self.btnRefreshCapabilities.setEnabled(state_disabled)
+        self.btnHarvest.setEnabled(state_disabled)
+        self.btnCheckConnections.setEnabled(state_disabled)
         self.btnEdit.setEnabled(state_disabled)
         self.btnDelete.setEnabled(state_disabled)
 
@@ -395,6 +661,7 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
 
         if caller == 'cmbConnectionsServices':  # clear server metadata
             self.textMetadata.clear()
+            self.btnStopHarvest.setEnabled(current_text in self.harvesters)
 
         self.btnCapabilities.setEnabled(False)
 
@@ -406,21 +673,136 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
         self.catalog_url = self.settings.value('%s/url' % key)
 
         # connect to the server
-        if not self._get_csw():
-            return
+        self.run_csw('capabilities', self.connection_info_finished)
 
-        QApplication.restoreOverrideCursor()
+    def refresh_capabilities(self):
+        """
+        drop cached capabilities of a connection and reload them from the
+        service, past the HTTP cache too
+        """
+
+        current_text = self.cmbConnectionsServices.currentText()
+        url = self.settings.value('/MetaSearch/%s/url' % current_text)
+        if url:
+            self.capabilities_cache.invalidate(url)
+            self.catalog_url = url
+            self.run_csw('capabilities', self.connection_info_finished,
+                         no_cache=True)
+
+    def check_connections(self):
+        """probe all connections and show how they answer"""
+
+        HealthDialog(self, self.spnTimeout.value(),
+                     self.capabilities_cache).exec_()
+        self.populate_connection_list()
+
+    def connection_info_finished(self, catalog):
+        """display service metadata once the catalogue has answered"""
+
+        self.catalog = catalog
 
         if self.catalog:  # display service metadata
             self.btnCapabilities.setEnabled(True)
-            metadata = render_template('en', self.context,
-                                       self.catalog,
-                                       'service_metadata.html')
+            with timing.span(self.timing, 'render'):
+                metadata = render_template('en', self.context,
+                                           self.catalog,
+                                           'service_metadata.html')
             style = QgsApplication.reportStyleSheet()
             self.textMetadata.clear()
             self.textMetadata.document().setDefaultStyleSheet(style)
             self.textMetadata.setHtml(metadata)
 
+    def harvest(self):
+        """copy the records of a connection into the record store"""
+
+        name = self.cmbConnectionsServices.currentText()
+        if name in self.harvesters:  # already running
+            return
+
+        url = self.settings.value('/MetaSearch/%s/url' % name)
+        if not url:
+            return
+
+        worker = Harvest_Worker(self, self.capabilities_cache)
+        worker.initialize(
+            url, self.spnTimeout.value(), self.record_store.filename,
+            self.settings.value('/MetaSearch/harvest_pagesize', 50, int))
+        worker.progress.connect(partial(self.harvest_progress, name))
+        worker.completed.connect(partial(self.harvest_completed, name))
+        worker.error.connect(partial(self.harvest_error, name))
+        worker.finished.connect(self.csw_worker_done)
+
+        if name in self.harvest_items:  # replace the row of a previous run
+            old = self.harvest_items.pop(name)
+            self.treeHarvests.takeTopLevelItem(
+                self.treeHarvests.indexOfTopLevelItem(old))
+
+        item = QTreeWidgetItem(self.treeHarvests)
+        item.setText(0, name)
+        item.setText(2, self.tr('Harvesting'))
+        progress = QProgressBar()
+        progress.setMaximum(0)  # busy until the first page arrives
+        self.treeHarvests.setItemWidget(item, 1, progress)
+        self.harvest_items[name] = item
+
+        self.csw_workers.add(worker)
+        self.harvesters[name] = worker
+        self.btnStopHarvest.setEnabled(True)
+        worker.start()
+
+    def stop_harvest(self):
+        """interrupt the harvest of a connection; it resumes next time"""
+
+        name = self.cmbConnectionsServices.currentText()
+        worker = self.harvesters.pop(name, None)
+        if worker is None:
+            return
+
+        worker.stop()
+        self.harvest_stopped(name, self.tr('Stopped'))
+        self.btnStopHarvest.setEnabled(False)
+
+    def harvest_progress(self, name, position, matches):
+        """update the progress bar of a harvest"""
+
+        item = self.harvest_items.get(name)
+        if item is None:
+            return
+        progress = self.treeHarvests.itemWidget(item, 1)
+        progress.setMaximum(max(matches, 1))
+        progress.setValue(min(position, matches))
+
+    def harvest_completed(self, name, matches):
+        """note a harvest which ran to completion"""
+
+        if self.harvesters.pop(name, None) is None:  # stopped
+            return
+
+        self.harvest_items[name].setText(
+            2, self.tr('Done (%d records)') % matches)
+        if name == self.cmbConnectionsServices.currentText():
+            self.btnStopHarvest.setEnabled(False)
+
+    def harvest_error(self, name, stage, err):
+        """note a harvest which failed; it resumes next time"""
+
+        if self.harvesters.pop(name, None) is None:  # stopped
+            return
+
+        LOGGER.warning('Harvest of %s failed: %s', name, err)
+        self.harvest_stopped(name, self.tr('Failed: %s') % err)
+        if name == self.cmbConnectionsServices.currentText():
+            self.btnStopHarvest.setEnabled(False)
+
+    def harvest_stopped(self, name, status):
+        """show the status of an unfinished harvest"""
+
+        item = self.harvest_items[name]
+        item.setText(2, status)
+        progress = self.treeHarvests.itemWidget(item, 1)
+        if progress.maximum() == 0:  # no page harvested yet
+            progress.setMaximum(1)
+
     def add_connection(self):
         """add new service"""
 
@@ -456,6 +838,9 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
         result = QMessageBox.information(self, self.tr('Confirm delete'), msg,
                                          QMessageBox.Ok | QMessageBox.Cancel)
         if result == QMessageBox.Ok:  # remove service from list
+            url = self.settings.value('%s/url' % key)
+            if url:
+                self.capabilities_cache.invalidate(url)
             self.settings.remove(key)
             index_to_delete = self.cmbConnectionsServices.currentIndex()
             self.cmbConnectionsServices.removeItem(index_to_delete)
@@ -616,10 +1001,45 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
         self.leWest.setText('-180')
         self.leEast.setText('180')
 
-    def geocoder_error(self, e):
-        """handle geocoder error"""
+    def geocoder_delayed(self, query):
+        """
+        show that the latest geocode is over budget; it stays open, so
+        late answers are still shown
+        """
+
+        if query != self.geocode_query:  # stale query
+            return
+        self.leWhere.setToolTip(self.tr('Still looking up %s...') % query)
+        if self.gazetteer is not None:
+            # not cached, the index is instant
+            LOGGER.debug('Geocoding %s offline meanwhile', query)
+            self.populate_autocomplete(self.gazetteer.geocode(query))
+
+    def geocoder_error(self, query, e):
+        """handle geocoder error, once every provider has failed"""
+
+        if query != self.geocode_query:  # stale query
+            return
+        self.geocode_query = None
+        self.leWhere.setToolTip(self.tr('Geocoding failed: %s') % e)
+        if self.gazetteer is not None:
+            # offline, or out of quota; not cached, the index is instant
+            LOGGER.debug('%s, geocoding %s offline', e, query)
+            self.populate_autocomplete(self.gazetteer.geocode(query))
+
+    def geocoder_ready(self, query, locations):
+        """cache and show the locations found by the latest geocode"""
 
-        self.leWhere.setText("{}".format(e))
+        if query != self.geocode_query:  # stale query
+            return
+        self.leWhere.setToolTip('')
+        if locations:
+            self.geocode_cache.put(self.geocode_key, query, locations)
+            self.place_index.add_locations(locations, query)
+        elif self.gazetteer is not None:
+            # nothing online; keep the offline places delayed showed
+            locations = self.gazetteer.geocode(query)
+        self.populate_autocomplete(locations)
 
     def populate_autocomplete(self, dict):
         """populate the autocomplete list """
@@ -652,16 +1072,18 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
         # error checking
 
 
-        print("populate_autocomplete: dict:\tlen: {0}".format(len(dict)))
         self.Locations = dict
 
-        if len(self.Locations) < 0 or len(self.leWhere.text()) < 3:
-            self.leWhere.setCompleter(None)
-            return
+        names = []
+        if len(self.leWhere.text()) >= 3:
+            names = sorted(self.Locations.keys())
+        self.location_model.setStringList(names)
 
-        completer = QCompleter(self.Locations.keys())
-        completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
-        self.leWhere.setCompleter(completer)
+        completer = self.leWhere.completer()
+        if names:
+            completer.complete()
+        else:
+            completer.popup().hide()
 
     def set_bbox_from_r_geocode(self):
         """set bounding box from reverse geolocation"""
@@ -703,14 +1125,29 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
     def search(self):
         """execute search"""
 
-        self.catalog = None
-        self.constraints = []
         if self.leWhere.text() != "":
             self.set_bbox_from_r_geocode()
 
+        # Enter in the keywords quickly followed by a click on Search; the
+        # running search still needs the state of the dialog
+        if self.search_running():
+            LOGGER.debug('Search already running')
+            return
+
+        self.catalog = None
+        self.constraints = []
+        self.federated_catalogs = {}
+        self.local_query = None
+        self.full_missing.clear()
+
+        # pages of the previous search are no longer wanted
+        if self.prefetch_worker is not None:
+            self.prefetch_worker.stop()
+            self.prefetch_worker = None
+
         # clear all fields and disable buttons
         self.lblResults.clear()
-        self.treeRecords.clear()
+        self.clear_records()
 
         self.reset_buttons()
 
@@ -730,6 +1167,55 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
         # set timeout
         self.timeout = self.spnTimeout.value()
 
+        self.constraints, keywords, bbox = self.query_constraints()
+
+        if self.cbLocal.isChecked():
+            self.local_query = (keywords, bbox)
+            self.local_search(0)
+            return
+
+        if self.cbFederated.isChecked():
+            self.federated_search()
+            return
+
+        # build request
+        # TODO: allow users to select resources types
+        # to find ('service', 'dataset', etc.)
+        self.run_csw('getrecords',
+                     partial(self.search_finished, streamed=True),
+                     stream=True, constraints=self.constraints,
+                     maxrecords=self.maxrecords, esn='summary')
+
+        # the count usually arrives well before the page of records
+        if self.csw_worker is not None:
+            self.request_count(self.catalog_url, self.constraints)
+
+    def search_running(self):
+        """return whether the search in the form is already running"""
+
+        worker = self.csw_worker
+        if worker is None or self.cbLocal.isChecked() or \
+                self.cbFederated.isChecked():
+            return False
+
+        url = self.settings.value(
+            '/MetaSearch/%s/url' % self.cmbConnectionsSearch.currentText())
+        if not url:
+            return False
+        key = operation_key('getrecords', url,
+                            constraints=self.query_constraints()[0],
+                            maxrecords=self.spnRecords.value(),
+                            esn='summary')
+        return worker.request_key == key
+
+    def query_constraints(self):
+        """
+        return the OGC constraints of the query in the search form, its
+        keywords and its bbox, None if global
+        """
+
+        constraints = []
+
         # bbox
         minx = self.leWest.text()
         miny = self.leSouth.text()
@@ -741,50 +1227,160 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
         # even for a global bbox, if a spatial filter is applied, then
         # the CSW server will skip records without a bbox
         if bbox != ['-180', '-90', '180', '90']:
-            self.constraints.append(BBox(bbox))
+            constraints.append(BBox(bbox))
+        else:
+            bbox = None
 
         # keywords
-        if self.leKeywords.text():
+        keywords = self.leKeywords.text()
+        if keywords:
             # TODO: handle multiple word searches
-            keywords = self.leKeywords.text()
-            self.constraints.append(PropertyIsLike('csw:AnyText', keywords))
+            constraints.append(PropertyIsLike('csw:AnyText', keywords))
 
-        if len(self.constraints) > 1:  # exclusive search (a && b)
-            self.constraints = [self.constraints]
+        if len(constraints) > 1:  # exclusive search (a && b)
+            constraints = [constraints]
 
-        # build request
-        if not self._get_csw():
+        return constraints, keywords, bbox
+
+    def schedule_count(self, *args):
+        """count the matches of the query once it stops changing"""
+
+        self.count_timer.start()
+
+    def count_matches(self):
+        """show the number of matches of the query being edited"""
+
+        self.stop_count()
+        self.lblCount.clear()
+
+        if self.cbFederated.isChecked():  # too many requests
             return
 
-        # TODO: allow users to select resources types
-        # to find ('service', 'dataset', etc.)
-        try:
-            self.catalog.getrecords2(constraints=self.constraints,
-                                     maxrecords=self.maxrecords, esn='full')
-        except ExceptionReport, err:
-            QApplication.restoreOverrideCursor()
-            QMessageBox.warning(self, self.tr('Search error'),
-                                self.tr('Search error: %s') % err)
+        url = self.settings.value(
+            '/MetaSearch/%s/url' % self.cmbConnectionsSearch.currentText())
+        if not url:
             return
-        except Exception, err:
-            QApplication.restoreOverrideCursor()
-            QMessageBox.warning(self, self.tr('Connection error'),
-                                self.tr('Connection error: %s') % err)
+
+        constraints, keywords, bbox = self.query_constraints()
+
+        if self.cbLocal.isChecked():
+            try:
+                matches = self.record_store.search(
+                    keywords, bbox, [url], 0, 0).results['matches']
+            except Exception, err:
+                LOGGER.debug('Cannot count matches: %s', err)
+                return
+            self.show_count(matches)
             return
 
+        self.request_count(url, constraints)
+
+    def request_count(self, url, constraints):
+        """send a GetRecords resultType=hits request for a query"""
+
+        key = request_key(url, constraints, 0, 0, 'hits')
+        if self.count_worker is not None and \
+                self.count_worker.request_key == key:  # on its way
+            return
+
+        self.stop_count()
+
+        matches = self.count_cache.get(key)
+        if matches is not None:
+            self.show_count(matches)
+            return
+
+        health = self.endpoint_health(url)
+        if not health.available():
+            return
+
+        worker = CSW_Worker(self, self.capabilities_cache)
+        worker.initialize('getrecords', url,
+                          health.timeout(self.spnTimeout.value()),
+                          constraints=constraints, maxrecords=0,
+                          resulttype='hits', esn='brief')
+        worker.health = health
+        worker.request_key = key
+        worker.resultsReady.connect(self.count_finished)
+        worker.error.connect(self.count_error)
+        worker.finished.connect(self.csw_worker_done)
+
+        self.lblCount.setText(self.tr('Counting...'))
+        self.csw_workers.add(worker)
+        self.count_worker = worker
+        worker.start()
+
+    def stop_count(self):
+        """abandon the running count request, if any"""
+
+        if self.count_worker is not None:
+            self.count_worker.stop()
+            self.count_worker = None
+
+    def count_finished(self, catalog):
+        """show the number of matches of a query"""
+
+        worker = self.sender()
+        timing.HISTORY.add(worker.timing)
+        self.update_health(worker.health, worker.timing)
+
+        matches = catalog.results['matches']
+        self.count_cache.put(worker.request_key, matches)
+
+        if worker is not self.count_worker:
+            return
+        self.count_worker = None
+        self.show_count(matches)
+
+        # a search waiting for its first records
+        if self.csw_worker is not None and self.catalog is None and \
+                self.streamed == 0:
+            self.lblResults.setText(
+                self.tr('%d results, loading...') % matches)
+
+    def count_error(self, stage, err):
+        """counting is a convenience; only note why it failed"""
+
+        worker = self.sender()
+        timing.HISTORY.add(worker.timing)
+        self.update_health(worker.health, worker.timing, stage, err)
+
+        if worker is not self.count_worker:
+            return
+        self.count_worker = None
+        self.lblCount.clear()
+        LOGGER.debug('Cannot count matches (%s): %s', stage, err)
+
+    def show_count(self, matches):
+        self.lblCount.setText(self.tr('~%d matches') % matches)
+
+    def search_finished(self, catalog, startfrom=0, streamed=False):
+        """handle GetRecords response"""
+
+        self.catalog = catalog
+        self.startfrom = startfrom
+        self.page_cache.put(self.page_key(startfrom), catalog)
+        key = request_key(catalog.url, self.constraints, 0, 0, 'hits')
+        self.count_cache.put(key, catalog.results['matches'])
+        if self.count_worker is not None and \
+                self.count_worker.request_key == key:  # no longer needed
+            self.stop_count()
+        if self.count_worker is None:
+            self.show_count(catalog.results['matches'])
+        self.store_records(catalog)
+
         if self.catalog.results['matches'] == 0:
-            QApplication.restoreOverrideCursor()
             self.lblResults.setText(self.tr('0 results'))
             return
 
-        QApplication.restoreOverrideCursor()
-        self.display_results()
+        # streamed records are already in the tree
+        self.display_results(not streamed or
+                             self.streamed != len(self.catalog.records))
+        self.prefetch_page(startfrom + self.maxrecords)
 
-    def display_results(self):
+    def display_results(self, populate=True):
         """display search results"""
 
-        self.treeRecords.clear()
-
         position = self.catalog.results['returned'] + self.startfrom
 
         msg = self.tr('Showing %d - %d of %d result%s') % \
@@ -794,18 +1390,11 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
 
         self.lblResults.setText(msg)
 
-        for rec in self.catalog.records:
-            item = QTreeWidgetItem(self.treeRecords)
-            if self.catalog.records[rec].type:
-                item.setText(0, normalize_text(self.catalog.records[rec].type))
-            else:
-                item.setText(0, 'unknown')
-            if self.catalog.records[rec].title:
-                item.setText(1,
-                             normalize_text(self.catalog.records[rec].title))
-            if self.catalog.records[rec].identifier:
-                set_item_data(item, 'identifier',
-                              self.catalog.records[rec].identifier)
+        if populate:
+            with timing.span(self.timing, 'populate'):
+                self.clear_records()
+                for rec in self.catalog.records:
+                    self.add_record_item(self.catalog.records[rec])
 
         self.btnShowXml.setEnabled(True)
 
@@ -819,43 +1408,388 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
         self.btnNext.setEnabled(disabled)
         self.btnLast.setEnabled(disabled)
 
+    def local_search(self, startfrom):
+        """search the records stored on this computer"""
+
+        self.cancel_csw()
+
+        # the current catalogue, or every catalogue for a federated search
+        urls = None
+        if not self.cbFederated.isChecked():
+            urls = [self.catalog_url]
+
+        keywords, bbox = self.local_query
+        try:
+            self.catalog = self.record_store.search(
+                keywords, bbox, urls, startfrom, self.maxrecords)
+        except Exception, err:
+            QMessageBox.warning(self, self.tr('Search error'),
+                                self.tr('Search error: %s') % err)
+            return
+        self.startfrom = startfrom
+
+        if self.catalog.results['matches'] == 0:
+            self.clear_records()
+            self.lblResults.setText(self.tr('0 results'))
+            return
+
+        self.display_results()
+
+    def store_records(self, catalog, esn='summary'):
+        """keep the records of a catalogue response for offline search"""
+
+        try:
+            self.record_store.put(catalog.url, catalog.records.values(),
+                                  esn)
+        except Exception, err:
+            LOGGER.warning('Cannot store records of %s: %s', catalog.url, err)
+
+    def clear_records(self):
+        """empty the results tree"""
+
+        self.treeRecords.clear()
+        self.records = {}
+
+    def add_record_item(self, record):
+        """add a record to the results tree"""
+
+        if record.identifier:
+            self.records[record.identifier] = record
+
+        item = QTreeWidgetItem(self.treeRecords)
+        if record.type:
+            item.setText(0, normalize_text(record.type))
+        else:
+            item.setText(0, 'unknown')
+        if record.title:
+            item.setText(1, normalize_text(record.title))
+        if record.identifier:
+            set_item_data(item, 'identifier', record.identifier)
+
+    def select_federated(self):
+        """choose the catalogues queried by a federated search"""
+
+        FederatedDialog().exec_()
+
+    def federated_search(self):
+        """send the current search to all federated catalogues"""
+
+        connections = []
+        self.settings.beginGroup('/MetaSearch/')
+        keys = self.settings.childGroups()
+        self.settings.endGroup()
+        skipped = []
+        for key in keys:
+            if self.settings.value('/MetaSearch/%s/federated' % key,
+                                   False, bool):
+                health = self.endpoint_health(name=key)
+                if not health.available():  # known to be down
+                    skipped.append(key)
+                    continue
+                connections.append(
+                    (key, self.settings.value('/MetaSearch/%s/url' % key),
+                     health.timeout(self.timeout)))
+
+        if skipped:
+            LOGGER.warning('Federated search: skipping %s',
+                           ', '.join(skipped))
+
+        if not connections:
+            if skipped:
+                msg = self.tr('All selected catalogues failed recently '
+                              'and are skipped for now: %s') % \
+                    ', '.join(skipped)
+            else:
+                msg = self.tr('No catalogues selected. Click '
+                              '\'Catalogues...\' to choose the catalogues '
+                              'to search.')
+            QMessageBox.information(self, self.tr('Federated search'), msg)
+            return
+
+        self.cancel_csw()
+
+        self.federated_matches = 0
+        self.federated_answered = 0
+        self.federated_total = len(connections)
+
+        self.federated = FederatedSearch(
+            self, self.capabilities_cache,
+            self.settings.value('/MetaSearch/federated_concurrency', 4, int))
+        self.federated.resultsReady.connect(self.federated_results)
+        self.federated.error.connect(self.federated_error)
+        self.federated.done.connect(self.federated_done)
+
+        self.set_busy(True)
+        self.update_federated_status()
+        self.federated.start(connections, self.timeout, self.retries(),
+                             constraints=self.constraints,
+                             maxrecords=self.maxrecords, esn='summary')
+
+    def federated_results(self, name, catalog, worker_timing):
+        """merge the results of one catalogue into the results tree"""
+
+        if self.sender() is not self.federated:
+            return
+
+        self.update_health(self.endpoint_health(name=name), worker_timing)
+
+        self.federated_answered += 1
+        self.federated_matches += catalog.results['matches']
+
+        if self.catalog is None:  # for the XML view until a record is chosen
+            self.catalog = catalog
+            self.catalog_url = catalog.url
+
+        for rec in catalog.records:
+            record = catalog.records[rec]
+            if record.identifier is None:
+                continue
+            if record.identifier in self.federated_catalogs:  # duplicate
+                continue
+            self.federated_catalogs[record.identifier] = catalog
+            self.add_record_item(record)
+
+        self.store_records(catalog)
+        self.update_federated_status()
+
+    def federated_error(self, name, stage, err, worker_timing):
+        """note a catalogue which failed to answer"""
+
+        if self.sender() is not self.federated:
+            return
+
+        self.update_health(self.endpoint_health(name=name), worker_timing,
+                           stage, err)
+
+        self.federated_answered += 1
+        if stage == 'timeout':
+            LOGGER.warning('Federated search: %s timed out', name)
+        else:
+            LOGGER.warning('Federated search: %s failed: %s', name, err)
+
+        self.update_federated_status()
+
+    def federated_done(self):
+        """all federated catalogues have answered"""
+
+        if self.sender() is not self.federated:
+            return
+
+        self.federated = None
+        self.set_busy(False)
+        self.update_federated_status()
+
+    def update_federated_status(self):
+        """show federated search progress"""
+
+        msg = self.tr('Showing %d of %d results from %d of %d catalogues') % \
+            (len(self.federated_catalogs), self.federated_matches,
+             self.federated_answered, self.federated_total)
+        self.lblResults.setText(msg)
+        self.btnShowXml.setEnabled(bool(self.federated_catalogs))
+
     def record_clicked(self):
         """record clicked signal"""
 
         # disable only service buttons
         self.reset_buttons(True, False, False)
 
-        if not self.treeRecords.selectedItems():
+        items = self.treeRecords.selectedItems()
+        if not items:
             return
 
+        # the list holds summary records; services need the full records,
+        # which are fetched together for the whole selection
+        records = []
+        for selected in items:
+            identifier = get_item_data(selected, 'identifier')
+            record = self.get_full_record(identifier)
+            if record is None:
+                record = self.records[identifier]
+                self.request_full_record(identifier)
+            records.append(record)
+
+        # show the footprints of the selected records on the map
+        self.rubber_band.reset(QGis.Polygon)
+        src = QgsCoordinateReferenceSystem(4326)
+        dst = self.map.mapRenderer().destinationCrs()
+        ctr = None
+        if src.postgisSrid() != dst.postgisSrid():
+            ctr = QgsCoordinateTransform(src, dst)
+        for record in records:
+            if record.bbox is None:
+                continue
+            points = bbox_to_polygon(record.bbox)
+            if points is None:
+                continue
+            geom = QgsGeometry.fromPolygon(points)
+            if ctr is not None:
+                try:
+                    geom.transform(ctr)
+                except Exception, err:
+                    QMessageBox.warning(
+                        self,
+                        self.tr('Coordinate Transformation Error'),
+                        str(err))
+            self.rubber_band.addGeometry(geom, None)
+
         item = self.treeRecords.currentItem()
-        if not item:
+        if not item or not item.isSelected():
             return
 
         identifier = get_item_data(item, 'identifier')
-        record = self.catalog.records[identifier]
-
-        # if the record has a bbox, show a footprint on the map
-        if record.bbox is not None:
-            points = bbox_to_polygon(record.bbox)
-            if points is not None:
-                src = QgsCoordinateReferenceSystem(4326)
-                dst = self.map.mapRenderer().destinationCrs()
-                geom = QgsGeometry.fromPolygon(points)
-                if src.postgisSrid() != dst.postgisSrid():
-                    ctr = QgsCoordinateTransform(src, dst)
-                    try:
-                        geom.transform(ctr)
-                    except Exception, err:
-                        QMessageBox.warning(
-                            self,
-                            self.tr('Coordinate Transformation Error'),
-                            str(err))
-                self.rubber_band.setToGeometry(geom, None)
+        if identifier in self.federated_catalogs:  # federated results
+            self.catalog = self.federated_catalogs[identifier]
+            self.catalog_url = self.catalog.url
 
         # figure out if the data is interactive and can be operated on
+        record = self.get_full_record(identifier) or self.records[identifier]
         self.find_services(record, item)
 
+    def record_catalog(self, identifier):
+        """return the catalogue a listed record comes from"""
+
+        return self.federated_catalogs.get(identifier, self.catalog)
+
+    def record_url(self, identifier):
+        """return the URL of the catalogue holding a listed record"""
+
+        if self.local_query is not None:
+            return self.catalog.urls[identifier]
+        return self.record_catalog(identifier).url
+
+    def get_full_record(self, identifier):
+        """return the full version of a listed record, or None"""
+
+        if self.local_query is not None and \
+                self.catalog.esns[identifier] == 'full':
+            return self.records[identifier]
+
+        return self.record_cache.get(self.record_url(identifier), identifier)
+
+    def request_full_record(self, identifier, now=False):
+        """queue a listed record for GetRecordById"""
+
+        url = self.record_url(identifier)
+        catalog = None  # stored records come from a catalogue not loaded
+        if self.local_query is None:
+            catalog = self.record_catalog(identifier)
+        key = (url, identifier)
+        if key in self.full_missing:  # asking again would not help
+            return
+        if key not in self.full_requested:
+            self.full_requested.add(key)
+            pending = self.full_pending.setdefault(url, (catalog, []))
+            pending[1].append(identifier)
+
+        if now:
+            self.full_timer.stop()
+            self.fetch_full_records()
+        else:
+            self.full_timer.start()
+
+    def fetch_full_records(self):
+        """
+        send one GetRecordById for the queued records of each catalogue,
+        split into chunks of at most /MetaSearch/getrecordbyid_chunk ids
+        """
+
+        chunk = self.settings.value('/MetaSearch/getrecordbyid_chunk', 50,
+                                    int)
+
+        for url, (catalog, identifiers) in self.full_pending.items():
+            for i in range(0, len(identifiers), chunk):
+                self.fetch_full_chunk(url, catalog, identifiers[i:i + chunk])
+
+        self.full_pending = {}
+
+    def fetch_full_chunk(self, url, catalog, identifiers):
+        """send a GetRecordById for identifiers"""
+
+        health = self.endpoint_health(url)
+
+        worker = CSW_Worker(self, self.capabilities_cache)
+        worker.initialize('getrecordbyid', url, health.timeout(self.timeout),
+                          catalog, id=identifiers, esn='full')
+        worker.health = health
+        worker.retries = self.retries()
+        worker.resultsReady.connect(self.full_records_ready)
+        worker.error.connect(self.full_records_error)
+        worker.finished.connect(self.csw_worker_done)
+
+        self.csw_workers.add(worker)
+        worker.start()
+
+    def full_records_ready(self, catalog):
+        """keep full records and refresh whatever is waiting for them"""
+
+        worker = self.sender()
+        timing.HISTORY.add(worker.timing)
+        self.update_health(worker.health, worker.timing)
+        for identifier in worker.kwargs['id']:
+            self.full_requested.discard((catalog.url, identifier))
+
+        received = set()
+        for record in catalog.records.values():
+            if record.identifier is None:
+                continue
+            record.xml_url = catalog.request
+            self.record_cache.put(catalog.url, record.identifier, record)
+            received.add(record.identifier)
+        self.store_records(catalog, 'full')
+
+        # deleted since the search, or renamed by the server
+        missing = [identifier for identifier in worker.kwargs['id']
+                   if identifier not in received]
+        if missing:
+            LOGGER.warning('GetRecordById did not return %s',
+                           ', '.join(missing))
+            self.full_missing.update([(catalog.url, identifier)
+                                      for identifier in missing])
+
+        selected = [get_item_data(item, 'identifier')
+                    for item in self.treeRecords.selectedItems()]
+        wanted = [identifier for identifier in missing
+                  if identifier in selected]
+
+        if any([identifier in received for identifier in selected]):
+            self.record_clicked()  # now with services
+
+        if self.metadata_pending is not None:
+            url, identifier = self.metadata_pending
+            if url == catalog.url and identifier in worker.kwargs['id']:
+                self.metadata_pending = None
+                record = self.record_cache.get(url, identifier)
+                if record is not None:
+                    self.display_record(record, url)
+                elif identifier not in wanted:
+                    wanted.append(identifier)
+
+        if wanted:
+            QMessageBox.warning(
+                self, self.tr('GetRecords error'),
+                self.tr('The catalogue did not return the full records '
+                        'of: %s') % ', '.join(wanted))
+
+    def full_records_error(self, stage, err):
+        """forget a failed GetRecordById so that it can be retried"""
+
+        worker = self.sender()
+        timing.HISTORY.add(worker.timing)
+        self.update_health(worker.health, worker.timing, stage, err)
+        for identifier in worker.kwargs['id']:
+            self.full_requested.discard((worker.url, identifier))
+
+        LOGGER.warning('GetRecordById failed: %s', err)
+
+        if self.metadata_pending is not None:
+            url, identifier = self.metadata_pending
+            if url == worker.url and identifier in worker.kwargs['id']:
+                self.metadata_pending = None
+                QMessageBox.warning(
+                    self, self.tr('GetRecords error'),
+                    self.tr('Error getting response: %s') % err)
+
     def find_services(self, record, item):
         """scan record for WMS/WMTS|WFS|WCS endpoints"""
 
@@ -899,46 +1833,143 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
         """manage navigation / paging"""
 
         caller = self.sender().objectName()
+        startfrom = self.startfrom
 
         if caller == 'btnFirst':
-            self.startfrom = 0
+            startfrom = 0
         elif caller == 'btnLast':
-            self.startfrom = self.catalog.results['matches'] - self.maxrecords
+            startfrom = self.catalog.results['matches'] - self.maxrecords
         elif caller == 'btnNext':
-            self.startfrom += self.maxrecords
-            if self.startfrom >= self.catalog.results["matches"]:
+            startfrom += self.maxrecords
+            if startfrom >= self.catalog.results["matches"]:
                 msg = self.tr('End of results. Go to start?')
                 res = QMessageBox.information(self, self.tr('Navigation'),
                                               msg,
                                               (QMessageBox.Ok |
                                                QMessageBox.Cancel))
                 if res == QMessageBox.Ok:
-                    self.startfrom = 0
+                    startfrom = 0
                 else:
                     return
         elif caller == "btnPrev":
-            self.startfrom -= self.maxrecords
-            if self.startfrom <= 0:
+            startfrom -= self.maxrecords
+            if startfrom <= 0:
                 msg = self.tr('Start of results. Go to end?')
                 res = QMessageBox.information(self, self.tr('Navigation'),
                                               msg,
                                               (QMessageBox.Ok |
                                                QMessageBox.Cancel))
                 if res == QMessageBox.Ok:
-                    self.startfrom = (self.catalog.results['matches'] -
-                                      self.maxrecords)
+                    startfrom = (self.catalog.results['matches'] -
+                                 self.maxrecords)
                 else:
                     return
 
-        QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+        self.load_page(startfrom)
 
-        self.catalog.getrecords2(constraints=self.constraints,
-                                 maxrecords=self.maxrecords,
-                                 startposition=self.startfrom, esn='full')
+    def page_key(self, startfrom):
+        """return the page cache key of a page of the current search"""
 
-        QApplication.restoreOverrideCursor()
+        return request_key(self.catalog_url, self.constraints, startfrom,
+                           self.maxrecords, 'summary')
 
-        self.display_results()
+    def load_page(self, startfrom):
+        """display a page of results, from the page cache if possible"""
+
+        if self.local_query is not None:
+            self.local_search(startfrom)
+            return
+
+        key = self.page_key(startfrom)
+
+        catalog = self.page_cache.get(key)
+        if catalog is not None:
+            self.cancel_csw()
+            self.search_finished(catalog, startfrom)
+            return
+
+        worker = self.prefetch_worker
+        if worker is not None and worker.request_key == key:  # on its way
+            self.cancel_csw()
+            self.prefetch_pending = key
+            self.set_busy(True, True)
+            return
+
+        self.run_csw('getrecords',
+                     partial(self.search_finished, startfrom=startfrom,
+                             streamed=True),
+                     self.catalog, stream=True, constraints=self.constraints,
+                     maxrecords=self.maxrecords,
+                     startposition=startfrom, esn='summary')
+
+    def prefetch_page(self, startfrom):
+        """fetch a page in the background while the user reads another"""
+
+        if startfrom >= self.catalog.results['matches']:
+            return
+
+        key = self.page_key(startfrom)
+        if key in self.page_cache:
+            return
+
+        if self.prefetch_worker is not None:
+            if self.prefetch_worker.request_key == key:
+                return
+            self.prefetch_worker.stop()
+
+        health = self.endpoint_health(self.catalog_url)
+        if not health.available():
+            return
+
+        worker = CSW_Worker(self, self.capabilities_cache)
+        worker.health = health
+        worker.initialize('getrecords', self.catalog_url,
+                          health.timeout(self.timeout),
+                          self.catalog, constraints=self.constraints,
+                          maxrecords=self.maxrecords,
+                          startposition=startfrom, esn='summary')
+        worker.request_key = key
+        worker.resultsReady.connect(self.prefetch_finished)
+        worker.error.connect(self.prefetch_error)
+        worker.finished.connect(self.csw_worker_done)
+
+        self.csw_workers.add(worker)
+        self.prefetch_worker = worker
+        worker.start()
+
+    def prefetch_finished(self, catalog):
+        """store a prefetched page, showing it if the user is waiting"""
+
+        worker = self.sender()
+        timing.HISTORY.add(worker.timing)
+        self.update_health(worker.health, worker.timing)
+        self.page_cache.put(worker.request_key, catalog)
+
+        if worker is not self.prefetch_worker:
+            return
+        self.prefetch_worker = None
+
+        if self.prefetch_pending == worker.request_key:
+            self.prefetch_pending = None
+            self.set_busy(False)
+            self.search_finished(catalog, worker.kwargs['startposition'])
+
+    def prefetch_error(self, stage, err):
+        """retry a failed prefetch in the foreground if it was awaited"""
+
+        worker = self.sender()
+        timing.HISTORY.add(worker.timing)
+        self.update_health(worker.health, worker.timing, stage, err)
+        if worker is not self.prefetch_worker:
+            return
+        self.prefetch_worker = None
+
+        LOGGER.debug('Prefetch of page %d failed: %s',
+                     worker.kwargs['startposition'], err)
+        if self.prefetch_pending == worker.request_key:
+            self.prefetch_pending = None
+            self.set_busy(False)
+            self.load_page(worker.kwargs['startposition'])
 
     def add_to_ows(self):
         """add to OWS provider connection list"""
@@ -1039,31 +2070,58 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
 
         identifier = get_item_data(item, 'identifier')
 
-        try:
-            QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
-            cat = CatalogueServiceWeb(self.catalog_url, timeout=self.timeout)
-            cat.getrecordbyid(
-                [self.catalog.records[identifier].identifier])
-        except ExceptionReport, err:
-            QApplication.restoreOverrideCursor()
-            QMessageBox.warning(self, self.tr('GetRecords error'),
-                                self.tr('Error getting response: %s') % err)
+        url = self.record_url(identifier)
+        record = self.get_full_record(identifier)
+        if record is not None:
+            self.display_record(record, url)
             return
 
-        QApplication.restoreOverrideCursor()
+        if (url, identifier) in self.full_missing:
+            QMessageBox.warning(
+                self, self.tr('GetRecords error'),
+                self.tr('The catalogue did not return the full records '
+                        'of: %s') % identifier)
+            return
 
-        record = cat.records[identifier]
-        record.xml_url = cat.request
+        # shown by full_records_ready
+        self.metadata_pending = (url, identifier)
+        self.request_full_record(identifier, True)
+
+    def display_record(self, record, url=None):
+        """show the metadata of a record, from url if it is cached"""
+
+        metadata = None
+        if url is not None:
+            metadata = self.record_cache.get_html(url, record.identifier)
+        if metadata is None:
+            render = timing.Timing('render',
+                                   url or self.record_store.filename)
+            with timing.span(render, 'render'):
+                metadata = render_template('en', self.context,
+                                           record, 'record_metadata_dc.html')
+            timing.HISTORY.add(render)
+            if url is not None:
+                self.record_cache.put_html(url, record.identifier, metadata)
 
         crd = RecordDialog()
-        metadata = render_template('en', self.context,
-                                   record, 'record_metadata_dc.html')
 
         style = QgsApplication.reportStyleSheet()
         crd.textMetadata.document().setDefaultStyleSheet(style)
         crd.textMetadata.setHtml(metadata)
         crd.exec_()
 
+    def show_timings(self):
+        """show the timings of recent catalogue operations"""
+
+        crd = RecordDialog()
+        crd.setWindowTitle(self.tr('Timings'))
+        html = render_template('en', self.context, timing.HISTORY.items(),
+                               'timings.html')
+        style = QgsApplication.reportStyleSheet()
+        crd.textMetadata.document().setDefaultStyleSheet(style)
+        crd.textMetadata.setHtml(html)
+        crd.exec_()
+
     def show_xml(self):
         """show XML request / response"""
 
@@ -1104,37 +2162,204 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
     def reject(self):
         """back out of dialogue"""
 
+        self.cancel_csw()
+        self.stop_count()
+        self.count_timer.stop()
+        self.stop_geocoder()
+        self.geocode_timer.stop()
+        if self.prefetch_worker is not None:
+            self.prefetch_worker.stop()
+            self.prefetch_worker = None
+        self.record_cache.flush()
+        self.geocode_cache.flush()
         QDialog.reject(self)
         self.rubber_band.reset()
 
-    def _get_csw(self):
-        """convenience function to init owslib.csw.CatalogueServiceWeb"""
+    def run_csw(self, operation, callback, catalog=None, stream=False,
+                no_cache=False, **kwargs):
+        """run a CSW request on a background worker
+
+        callback is invoked with the resulting
+        owslib.csw.CatalogueServiceWeb once the request succeeds; any
+        other request still in flight is cancelled first, while an
+        identical one is joined.  With stream, records are added to the
+        results tree while the response downloads.  With no_cache,
+        GetCapabilities is sent past the caches and never joined
+        """
+
+        key = operation_key(operation, self.catalog_url, **kwargs)
+        if not no_cache and self.csw_worker is not None and \
+                self.csw_worker.request_key == key:
+            LOGGER.debug('Joining the running %s request', operation)
+            self.csw_worker.callback = callback
+            return
 
-        # connect to the server
+        self.cancel_csw()
+
+        # Service info is the way to check a catalogue known to be down
+        health = self.endpoint_health(self.catalog_url)
+        if operation != 'capabilities' and not health.available():
+            QMessageBox.warning(
+                self, self.tr('Connection error'),
+                self.tr('The service failed %d times in a row and is '
+                        'skipped for another %d seconds. Use \'Service '
+                        'info\' on the Services tab to check it now.\n\n'
+                        'Last error: %s') %
+                (health.consecutive, health.retry_in(), health.last_error))
+            return
+
+        worker = CSW_Worker(self, self.capabilities_cache)
+        worker.initialize(operation, self.catalog_url,
+                          health.timeout(self.timeout), catalog, **kwargs)
+        worker.health = health
+        worker.retries = self.retries()
+        worker.request_key = key
+        worker.callback = callback
+        worker.stream = stream
+        worker.no_cache = no_cache
+        worker.recordReady.connect(self.csw_record)
+        worker.resultsReady.connect(self.csw_finished)
+        worker.error.connect(self.csw_error)
+        worker.finished.connect(self.csw_worker_done)
+
+        # keep a reference until the thread has actually stopped
+        self.csw_workers.add(worker)
+        self.csw_worker = worker
+        self.streamed = 0
+        self.set_busy(True, operation == 'getrecords')
+        worker.start()
+
+    def cancel_csw(self):
+        """cancel the running CSW request, if any"""
+
+        if self.csw_worker is not None:
+            self.csw_worker.stop()
+            self.csw_worker = None
+        if self.federated is not None:
+            self.federated.stop()
+            self.federated = None
+        self.prefetch_pending = None
+        self.set_busy(False)
+
+    def csw_finished(self, catalog):
+        """dispatch results of the current CSW worker"""
+
+        worker = self.sender()
+        if worker is not self.csw_worker:  # cancelled or superseded
+            return
+
+        self.csw_worker = None
+        self.set_busy(False)
+        self.update_health(worker.health, worker.timing)
+
+        # populate and render spans are added by the callback
+        self.timing = worker.timing
         try:
-            QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
-            self.catalog = CatalogueServiceWeb(self.catalog_url,
-                                               timeout=self.timeout)
-            return True
-        except ExceptionReport, err:
-            msg = self.tr('Error connecting to service: %s') % err
-        except ValueError, err:
-            msg = self.tr('Value Error: %s') % err
-        except Exception, err:
-            msg = self.tr('Unknown Error: %s') % err
+            worker.callback(catalog)
+        finally:
+            self.timing = None
+            timing.HISTORY.add(worker.timing)
 
-        QMessageBox.warning(self, self.tr('CSW Connection error'), msg)
-        QApplication.restoreOverrideCursor()
-        return False
+    def csw_record(self, record):
+        """add a record streamed by the current CSW worker"""
+
+        if self.sender() is not self.csw_worker:  # cancelled or superseded
+            return
+
+        with timing.span(self.sender().timing, 'populate'):
+            if self.streamed == 0:  # first record of a new page
+                self.clear_records()
+                self.reset_buttons(True, False, False)
+            self.streamed += 1
+            self.add_record_item(record)
+
+    def csw_error(self, stage, err):
+        """report errors of the current CSW worker"""
+
+        worker = self.sender()
+        if worker is not self.csw_worker:  # cancelled or superseded
+            return
+
+        self.csw_worker = None
+        self.set_busy(False)
+        timing.HISTORY.add(worker.timing)
+        self.update_health(worker.health, worker.timing, stage, err)
+
+        if stage == 'connect':
+            title = self.tr('CSW Connection error')
+            if isinstance(err, ExceptionReport):
+                msg = self.tr('Error connecting to service: %s') % err
+            elif isinstance(err, ValueError):
+                msg = self.tr('Value Error: %s') % err
+            else:
+                msg = self.tr('Unknown Error: %s') % err
+        elif worker.operation == 'getrecordbyid':
+            title = self.tr('GetRecords error')
+            msg = self.tr('Error getting response: %s') % err
+        elif isinstance(err, ExceptionReport):
+            title = self.tr('Search error')
+            msg = self.tr('Search error: %s') % err
+        else:
+            title = self.tr('Connection error')
+            msg = self.tr('Connection error: %s') % err
+
+        QMessageBox.warning(self, title, msg)
+
+    def retries(self):
+        """return how often transient failures are retried"""
+
+        return self.settings.value('/MetaSearch/retries', 2, int)
+
+    def endpoint_health(self, url=None, name=None):
+        """return the health statistics of a connection"""
+
+        if name is None:
+            name = connection_name(self.settings, url)
+        return EndpointHealth(self.settings, name)
+
+    def update_health(self, health, worker_timing, stage=None, err=None):
+        """record the outcome of a request in the endpoint statistics"""
+
+        if health is None:
+            return
+        if stage is None:
+            if worker_timing is not None:
+                health.record_success(worker_timing.elapsed())
+        else:
+            health.record_error(stage, err)
+
+    def csw_worker_done(self):
+        """release a finished CSW worker"""
+
+        worker = self.sender()
+        self.csw_workers.discard(worker)
+        worker.deleteLater()
+
+    def set_busy(self, busy, searching=False):
+        """reflect whether a CSW request is running"""
+
+        self.btnCancel.setEnabled(busy)
+        if searching:
+            self.results_text = self.lblResults.text()
+            self.lblResults.setText(self.tr('Searching...'))
+        elif not busy and self.results_text is not None:
+            self.lblResults.setText(self.results_text)
+            self.results_text = None
 
     def install_proxy(self):
-        """set proxy if one is set in QGIS network settings"""
+        """
+        install the keep-alive HTTP transport, with the proxy set in QGIS
+        network settings if any
+        """
+
+        proxies = None
 
         # initially support HTTP for now
         if self.settings.value('/proxy/proxyEnabled') == 'true':
             if self.settings.value('/proxy/proxyType') == 'HttpProxy':
                 ptype = 'http'
             else:
+                transport.install(cache=self.http_cache)
                 return
 
             user = self.settings.value('/proxy/proxyUser')
@@ -1152,7 +2377,10 @@ class MetaSearchDialog(QDialog, BASE_CLASS):
                 proxy_port = ':%s' % port
 
             conn = '%s://%s%s%s' % (ptype, proxy_up, host, proxy_port)
-            install_opener(build_opener(ProxyHandler({ptype: conn})))
+            # https is tunnelled through the same proxy
+            proxies = {'http': conn, 'https': conn}
+
+        transport.install(proxies, self.http_cache)
 
 
 def save_connections():
@@ -1186,27 +2414,6 @@ def _get_field_value(field):
     return value
 
 
-def geolocator_to_bbox(geolocator_type, resp):
-    """Parses the geolocation service's respond as ullr"""
-
-    try:
-        if geolocator_type == "googlev3":
-            maxy = float(resp[u"geometry"][u"bounds"][u"northeast"][u"lat"])
-            maxx = float(resp[u"geometry"][u"bounds"][u"northeast"][u"lng"])
-            miny = float(resp[u"geometry"][u"bounds"][u"southwest"][u"lat"])
-            minx = float(resp[u"geometry"][u"bounds"][u"southwest"][u"lng"])
-        elif geolocator_type == "nominatim":
-            maxx = float(resp[u'boundingbox'][3])
-            maxy = float(resp[u'boundingbox'][1])
-            minx = float(resp[u'boundingbox'][2])
-            miny = float(resp[u'boundingbox'][0])
-
-        return maxx, maxy, minx, miny
-    except:
-        # Sometimes the geolocator returns POIs of interest without bbox
-        return
-
-
 def bbox_to_polygon(bbox):
     """converts OWSLib bbox object to list of QgsPoint objects"""
 
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# CSW Client
+# ---------------------------------------------------------
+# QGIS Catalogue Service client.
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+###############################################################################
+
+from collections import deque
+import bisect
+import codecs
+import logging
+import math
+import mmap
+import os
+import struct
+
+from MetaSearch_geocode.cache import normalize_query
+
+LOGGER = logging.getLogger('MetaSearch(Geocode)')
+
+# header of an index file: magic, number of records, size of the records
+HEADER = struct.Struct('<8sII')
+MAGIC = 'MSGAZ001'
+
+# key offset and length, name offset and length, population, minx, miny,
+# maxx, maxy; offsets point into the strings following the records
+RECORD = struct.Struct('<IIIIIffff')
+
+# prefix lookups rank at most this many matching records by population
+MAX_SCAN = 500
+
+
+class _Node(object):
+    """node of a PlaceTrie; label is the text of the edge leading to it"""
+
+    __slots__ = ('label', 'edges', 'places')
+
+    def __init__(self, label):
+        self.label = label
+        self.edges = {}
+        self.places = None
+
+
+class PlaceTrie(object):
+    """
+    radix tree of place names, matched on normalized prefixes; each place
+    has the bounding box (maxx, maxy, minx, miny) of the geocoders
+    """
+
+    def __init__(self):
+        self.root = _Node(u'')
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, key, name, bbox):
+        """index place name, with its bbox, under key"""
+
+        key = normalize_query(key)
+        if not key:
+            return
+        node = self.root
+        while key:
+            child = node.edges.get(key[0])
+            if child is None:
+                child = _Node(key)
+                node.edges[key[0]] = child
+                node = child
+                break
+
+            label = child.label
+            common = 1
+            while (common < len(label) and common < len(key) and
+                   label[common] == key[common]):
+                common += 1
+            if common < len(label):  # split the edge
+                middle = _Node(label[:common])
+                child.label = label[common:]
+                middle.edges[child.label[0]] = child
+                node.edges[key[0]] = middle
+                child = middle
+            node = child
+            key = key[common:]
+
+        if node.places is None:
+            node.places = {}
+        if name not in node.places:
+            self.size += 1
+        node.places[name] = bbox
+
+    def add_locations(self, locations, query=None):
+        """index geocoded locations by address, and by query if given"""
+
+        for name, bbox in locations.items():
+            self.add(name, name, bbox)
+            if query is not None:
+                self.add(query, name, bbox)
+
+    def complete(self, prefix, limit=10):
+        """
+        return up to limit places whose key starts with prefix, as a
+        dict of name: bbox; the places nearest to prefix are preferred
+        """
+
+        key = normalize_query(prefix)
+        node = self.root
+        while key:
+            child = node.edges.get(key[0])
+            if child is None:
+                return {}
+            label = child.label
+            if label.startswith(key):
+                node = child
+                break
+            if not key.startswith(label):
+                return {}
+            node = child
+            key = key[len(label):]
+
+        found = {}
+        queue = deque([node])
+        while queue and len(found) < limit:
+            node = queue.popleft()
+            if node.places:
+                for name, bbox in node.places.items():
+                    found.setdefault(name, bbox)
+            queue.extend(node.edges.values())
+
+        if len(found) > limit:
+            found = dict(sorted(found.items())[:limit])
+        return found
+
+
+def load_gazetteer(trie, filename):
+    """
+    index a gazetteer file: one place per line, as tab separated name,
+    minx, miny, maxx and maxy; return the number of places read
+    """
+
+    count = 0
+    with codecs.open(filename, encoding='utf-8') as fileobj:
+        for line in fileobj:
+            fields = line.rstrip(u'\r\n').split(u'\t')
+            if len(fields) < 5 or line.startswith(u'#'):
+                continue
+            try:
+                minx, miny, maxx, maxy = [float(value) for value in
+                                          fields[1:5]]
+            except ValueError:
+                continue
+            trie.add(fields[0], fields[0], (maxx, maxy, minx, miny))
+            count += 1
+
+    LOGGER.debug('Read %d places from gazetteer %s', count, filename)
+    return count
+
+
+def point_bbox(lon, lat, population, feature_class):
+    """
+    return a bbox (maxx, maxy, minx, miny) around a gazetteer point; its
+    size grows with the population, and is larger for administrative
+    areas
+    """
+
+    radius = 0.02 + 0.0002 * math.sqrt(max(population, 0))
+    if feature_class == 'A':
+        radius *= 4
+    return (min(lon + radius, 180), min(lat + radius, 90),
+            max(lon - radius, -180), max(lat - radius, -90))
+
+
+def read_places(filename):
+    """
+    yield the (key, name, population, bbox) of the places of a gazetteer
+    dump: either the GeoNames TSV format, or the five column format read
+    by load_gazetteer
+    """
+
+    with codecs.open(filename, encoding='utf-8') as fileobj:
+        for line in fileobj:
+            if line.startswith(u'#'):
+                continue
+            fields = line.rstrip(u'\r\n').split(u'\t')
+            try:
+                if len(fields) >= 15:  # GeoNames
+                    lat, lon = float(fields[4]), float(fields[5])
+                    population = int(fields[14] or 0)
+                    bbox = point_bbox(lon, lat, population, fields[6])
+                    name = fields[1]
+                    if fields[8]:
+                        name = u'%s, %s' % (name, fields[8])
+                    keys = set([normalize_query(fields[1]),
+                                normalize_query(fields[2])])
+                elif len(fields) >= 5:
+                    minx, miny, maxx, maxy = [float(value) for value in
+                                              fields[1:5]]
+                    bbox = (maxx, maxy, minx, miny)
+                    population = 0
+                    name = fields[0]
+                    keys = [normalize_query(fields[0])]
+                else:
+                    continue
+            except ValueError:
+                continue
+
+            for key in keys:
+                if key:
+                    yield key, name, population, bbox
+
+
+def build_index(source, target):
+    """
+    write the places of the gazetteer dump source to the index file
+    target, sorted by key; return the number of records written
+    """
+
+    places = sorted([(key.encode('utf-8'), name.encode('utf-8'),
+                      population, bbox)
+                     for key, name, population, bbox in read_places(source)])
+
+    strings = []
+    offset = 0
+    records = []
+    for key, name, population, bbox in places:
+        maxx, maxy, minx, miny = bbox
+        records.append(RECORD.pack(offset, len(key),
+                                   offset + len(key), len(name),
+                                   min(population, 0xffffffff),
+                                   minx, miny, maxx, maxy))
+        strings.extend([key, name])
+        offset += len(key) + len(name)
+
+    tmp = '%s.tmp' % target
+    with open(tmp, 'wb') as fileobj:
+        fileobj.write(HEADER.pack(MAGIC, len(records),
+                                  len(records) * RECORD.size))
+        fileobj.write(''.join(records))
+        fileobj.write(''.join(strings))
+    if os.name == 'nt' and os.path.exists(target):
+        os.remove(target)
+    os.rename(tmp, target)
+
+    LOGGER.info('Indexed %d places of %s in %s', len(records), source, target)
+    return len(records)
+
+
+class _Keys(object):
+    """sequence view of the keys of a GazetteerIndex, for bisect"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        return self.index.key(i)
+
+
+class GazetteerIndex(object):
+    """
+    memory-mapped index of places written by build_index; records are
+    read on demand, so opening it does not load the file
+    """
+
+    def __init__(self, filename):
+        """raises IOError if filename is not an index"""
+
+        self.filename = filename
+        with open(filename, 'rb') as fileobj:
+            self.data = mmap.mmap(fileobj.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        magic = None
+        if len(self.data) >= HEADER.size:
+            magic, self.count, size = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            self.data.close()
+            raise IOError('Not a gazetteer index: %s' % filename)
+        self.strings = HEADER.size + size
+        self.keys = _Keys(self)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.data.close()
+
+    def record(self, i):
+        """return the raw fields of record i"""
+
+        return RECORD.unpack_from(self.data, HEADER.size + i * RECORD.size)
+
+    def key(self, i):
+        """return the UTF-8 key of record i"""
+
+        offset, length = RECORD.unpack_from(
+            self.data, HEADER.size + i * RECORD.size)[:2]
+        start = self.strings + offset
+        return self.data[start:start + length]
+
+    def place(self, i):
+        """return the (name, population, bbox) of record i"""
+
+        fields = self.record(i)
+        start = self.strings + fields[2]
+        name = self.data[start:start + fields[3]].decode('utf-8')
+        minx, miny, maxx, maxy = fields[5:9]
+        return name, fields[4], (maxx, maxy, minx, miny)
+
+    def lookup(self, query, limit=10):
+        """return up to limit places named query, most populous first"""
+
+        key = normalize_query(query).encode('utf-8')
+        start = bisect.bisect_left(self.keys, key)
+        end = bisect.bisect_right(self.keys, key, start,
+                                  min(self.count, start + MAX_SCAN))
+        return self._ranked(xrange(start, end), limit)
+
+    def complete(self, prefix, limit=10):
+        """
+        return up to limit places whose name starts with prefix, most
+        populous first
+        """
+
+        key = normalize_query(prefix).encode('utf-8')
+        if not key:
+            return []
+        start = bisect.bisect_left(self.keys, key)
+        end = start
+        while (end < self.count and end - start < MAX_SCAN and
+               self.key(end).startswith(key)):
+            end += 1
+        return self._ranked(xrange(start, end), limit)
+
+    def geocode(self, query, limit=10):
+        """
+        return the places named query, or else starting with it, as a
+        dict of name: bbox like GeoCoder_Worker.data
+        """
+
+        places = self.lookup(query, limit) or self.complete(query, limit)
+        data = {}
+        for name, population, bbox in places:
+            if name in data:  # homonyms in the same country
+                name = u'%s (%.2f, %.2f)' % (name, (bbox[0] + bbox[2]) / 2,
+                                             (bbox[1] + bbox[3]) / 2)
+            data[name] = bbox
+        return data
+
+    def _ranked(self, indices, limit):
+        places = [self.place(i) for i in indices]
+        places.sort(key=lambda place: -place[1])
+        return places[:limit]
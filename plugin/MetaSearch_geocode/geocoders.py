@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# CSW Client
+# ---------------------------------------------------------
+# QGIS Catalogue Service client.
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+###############################################################################
+
+from abc import ABCMeta, abstractmethod
+import logging
+from Queue import Empty, Queue
+import threading
+import time
+
+from geopy.geocoders import Nominatim, GoogleV3
+
+LOGGER = logging.getLogger('MetaSearch(Geocode)')
+
+# seconds between checks for cancellation while racing providers
+POLL = 0.1
+
+
+def geolocator_to_bbox(geolocator_type, resp):
+    """
+    Parses the geolocation service's respond as ullr; None when the
+    location has no extent
+    """
+
+    try:
+        if geolocator_type == "googlev3":
+            geometry = resp[u"geometry"]
+            # POIs have a viewport but no bounds
+            bounds = geometry.get(u"bounds") or geometry[u"viewport"]
+            maxy = float(bounds[u"northeast"][u"lat"])
+            maxx = float(bounds[u"northeast"][u"lng"])
+            miny = float(bounds[u"southwest"][u"lat"])
+            minx = float(bounds[u"southwest"][u"lng"])
+        elif geolocator_type == "nominatim":
+            maxx = float(resp[u'boundingbox'][3])
+            maxy = float(resp[u'boundingbox'][1])
+            minx = float(resp[u'boundingbox'][2])
+            miny = float(resp[u'boundingbox'][0])
+        else:
+            return None
+
+        return maxx, maxy, minx, miny
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+class Provider(object):
+    """a geocoding service"""
+
+    __metaclass__ = ABCMeta
+
+    name = None
+
+    @abstractmethod
+    def geocode(self, query):
+        """
+        return the locations matching query as a dict of address: bbox
+        (maxx, maxy, minx, miny); raises geopy errors
+        """
+
+
+class GeopyProvider(Provider):
+    """a provider wrapping a geopy geocoder"""
+
+    def __init__(self, geolocator):
+        self.geolocator = geolocator
+
+    def geocode(self, query):
+        response = self.geolocator.geocode(query, exactly_one=False)
+        data = {}
+        for location in response or []:
+            bbox = geolocator_to_bbox(self.name, location.raw)
+            if bbox is not None:
+                data[location.address] = bbox
+        return data
+
+
+class GoogleProvider(GeopyProvider):
+    name = 'googlev3'
+
+    def __init__(self, api_key=None, timeout=None):
+        super(GoogleProvider, self).__init__(
+            GoogleV3(api_key=api_key or None, timeout=timeout))
+
+
+class NominatimProvider(GeopyProvider):
+    name = 'nominatim'
+
+    def __init__(self, timeout=None):
+        super(NominatimProvider, self).__init__(Nominatim(timeout=timeout))
+
+
+class GazetteerProvider(Provider):
+    """the offline gazetteer.GazetteerIndex"""
+
+    name = 'gazetteer'
+
+    def __init__(self, index):
+        self.index = index
+
+    def geocode(self, query):
+        return self.index.geocode(query)
+
+
+def get_provider(name, api_key=None, timeout=None, index=None):
+    """return the provider called name, or None if it is unknown"""
+
+    if name == 'googlev3':
+        return GoogleProvider(api_key, timeout)
+    if name == 'nominatim':
+        return NominatimProvider(timeout)
+    if name == 'gazetteer' and index is not None:
+        return GazetteerProvider(index)
+    LOGGER.warning('Unknown geocoding provider %s', name)
+    return None
+
+
+def _answer(provider, query, answers):
+    try:
+        answers.put((provider, provider.geocode(query), None))
+    except Exception, err:
+        answers.put((provider, None, err))
+
+
+def race(providers, query, budget, stopped=None):
+    """
+    query the providers concurrently; yield (provider, locations, error)
+    as each one answers, until all have answered or stopped() returns
+    True. If providers are still running after budget seconds,
+    (None, None, None) is yielded once; their late answers follow.
+    """
+
+    answers = Queue()
+    for provider in providers:
+        thread = threading.Thread(target=_answer,
+                                  args=(provider, query, answers))
+        thread.daemon = True
+        thread.start()
+
+    deadline = time.time() + budget
+    pending = len(providers)
+    while pending:
+        if stopped is not None and stopped():
+            return
+        wait = POLL
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                LOGGER.debug('Geocoding %s: %d providers over budget',
+                             query, pending)
+                deadline = None
+                yield None, None, None
+            else:
+                wait = min(POLL, remaining)
+        try:
+            answer = answers.get(timeout=wait)
+        except Empty:
+            continue
+        pending -= 1
+        yield answer
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# CSW Client
+# ---------------------------------------------------------
+# QGIS Catalogue Service client.
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+###############################################################################
+
+import httplib
+import logging
+import socket
+import time
+from urllib2 import HTTPError, URLError
+
+from MetaSearch_geocode.cache import canonical_url
+
+LOGGER = logging.getLogger('MetaSearch(Geocode)')
+
+# weight of the newest sample in the latency averages
+ALPHA = 0.2
+
+# consecutive failures which open the circuit, and how long it stays open
+FAILURE_THRESHOLD = 3
+COOLDOWN = 60
+MAX_COOLDOWN = 1800
+
+# adaptive timeouts never exceed this many seconds
+MAX_TIMEOUT = 120
+
+# number of request outcomes kept in the latency history
+HISTORY_SIZE = 30
+
+
+def connection_name(settings, url):
+    """return the name of the connection to url, or None"""
+
+    url = canonical_url(url)
+
+    settings.beginGroup('/MetaSearch/')
+    keys = settings.childGroups()
+    settings.endGroup()
+
+    for key in keys:
+        value = settings.value('/MetaSearch/%s/url' % key)
+        if value and canonical_url(value) == url:
+            return key
+    return None
+
+
+def is_transient(err):
+    """return whether a failed request is worth retrying"""
+
+    if isinstance(err, HTTPError):
+        return err.code >= 500
+    return isinstance(err, (URLError, socket.error, httplib.HTTPException))
+
+
+class EndpointHealth(object):
+    """
+    latency and error statistics of a catalogue connection, kept in
+    /MetaSearch/<name>/health
+    """
+
+    def __init__(self, settings, name):
+        """name is None for a URL which is not a saved connection"""
+
+        self.settings = settings
+        self.name = name
+        self.key = '/MetaSearch/%s/health' % name
+
+        self.latency = self._value('latency', 0.0, float)
+        self.deviation = self._value('deviation', 0.0, float)
+        self.successes = self._value('successes', 0, int)
+        self.failures = self._value('failures', 0, int)
+        self.consecutive = self._value('consecutive', 0, int)
+        self.last_failure = self._value('last_failure', 0.0, float)
+        self.last_error = self._value('last_error', '', unicode)
+
+        # latest outcomes, oldest first: milliseconds, or None for failures
+        self.history = [None if value == 'x' else int(value) for value in
+                        self._value('history', '', unicode).split()]
+
+    def _value(self, key, default, type_):
+        if self.name is None:
+            return default
+        return self.settings.value('%s/%s' % (self.key, key), default,
+                                   type_)
+
+    def save(self):
+        """persist the statistics"""
+
+        if self.name is None:
+            return
+        for key in ['latency', 'deviation', 'successes', 'failures',
+                    'consecutive', 'last_failure', 'last_error']:
+            self.settings.setValue('%s/%s' % (self.key, key),
+                                   getattr(self, key))
+        history = ['x' if value is None else str(value)
+                   for value in self.history[-HISTORY_SIZE:]]
+        self.settings.setValue('%s/history' % self.key, ' '.join(history))
+
+    def record_success(self, seconds):
+        """note a request answered in seconds"""
+
+        if self.successes == 0:
+            self.latency = seconds
+            self.deviation = seconds / 2
+        else:
+            self.deviation += ALPHA * (abs(seconds - self.latency) -
+                                       self.deviation)
+            self.latency += ALPHA * (seconds - self.latency)
+        self.successes += 1
+        self.consecutive = 0
+        self.history.append(int(round(seconds * 1000)))
+        self.save()
+
+    def record_failure(self, error):
+        """note a failed request"""
+
+        self.failures += 1
+        self.consecutive += 1
+        self.last_failure = time.time()
+        self.last_error = unicode(error)
+        self.history.append(None)
+        self.save()
+
+    def record_error(self, stage, err):
+        """
+        note a request which failed in stage; only timeouts and transient
+        errors count against the endpoint
+        """
+
+        if stage == 'timeout':
+            self.record_failure('timed out')
+        elif is_transient(err):
+            self.record_failure(err)
+
+    def cooldown(self):
+        """return the seconds the circuit stays open after a failure"""
+
+        if self.consecutive < FAILURE_THRESHOLD:
+            return 0
+        return min(MAX_COOLDOWN,
+                   COOLDOWN * 2 ** (self.consecutive - FAILURE_THRESHOLD))
+
+    def retry_in(self):
+        """
+        return the seconds until the endpoint may be tried again; 0 once
+        the circuit is closed or half open
+        """
+
+        remaining = self.last_failure + self.cooldown() - time.time()
+        return max(0, int(remaining))
+
+    def available(self):
+        """return whether a request should be sent at all"""
+
+        return self.retry_in() == 0
+
+    def timeout(self, default):
+        """
+        return the timeout for a request: at least default, longer for
+        endpoints known to answer slowly
+        """
+
+        if self.successes == 0:
+            return default
+        adaptive = 2 * self.latency + 4 * self.deviation
+        return int(min(MAX_TIMEOUT, max(default, adaptive)))
@@ -112,6 +112,8 @@ class MetaSearchPlugin(object):
         self.iface.removePluginWebMenu(self.web_menu, self.action_help)
         self.iface.removeWebToolBarIcon(self.action_run)
 
+        self.dialog.shutdown()
+
     def run(self):
         """open MetaSearch"""
         self.dialog.show()
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# CSW Client
+# ---------------------------------------------------------
+# QGIS Catalogue Service client.
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+###############################################################################
+
+import logging
+import os
+import sqlite3
+import time
+
+from owslib.csw import CswRecord
+from owslib.etree import etree
+from owslib.util import OrderedDict
+
+from MetaSearch_geocode.cache import canonical_url
+
+LOGGER = logging.getLogger('MetaSearch(Geocode)')
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS records (
+        id INTEGER PRIMARY KEY,
+        url TEXT NOT NULL,
+        identifier TEXT NOT NULL,
+        type TEXT,
+        title TEXT,
+        modified TEXT,
+        anytext TEXT,
+        minx REAL,
+        miny REAL,
+        maxx REAL,
+        maxy REAL,
+        xml TEXT NOT NULL,
+        esn TEXT,
+        stored REAL,
+        UNIQUE (url, identifier))''',
+    'CREATE INDEX IF NOT EXISTS records_bbox_idx '
+    'ON records (minx, maxx, miny, maxy)',
+    # since: start time of the last complete harvest; started and position:
+    # start time and next startPosition of a harvest still under way
+    '''CREATE TABLE IF NOT EXISTS harvests (
+        url TEXT PRIMARY KEY,
+        since TEXT,
+        started TEXT,
+        position INTEGER)''',
+]
+
+# element sets by completeness; a record is only replaced by one at least
+# as complete. Rows stored without an element set count as summaries
+ESN_RANK = {'brief': 0, 'summary': 1, 'full': 2}
+
+# optional SQLite modules; without them anytext is matched with LIKE and
+# the bbox columns of the records table are scanned
+FTS_SCHEMA = ('CREATE VIRTUAL TABLE IF NOT EXISTS records_fts '
+              'USING fts4(anytext)')
+RTREE_SCHEMA = ('CREATE VIRTUAL TABLE IF NOT EXISTS records_rtree '
+                'USING rtree(id, minx, maxx, miny, maxy)')
+
+
+def record_anytext(record):
+    """return the text of a CswRecord matched by keyword searches"""
+
+    values = [record.identifier, record.title, record.alternative,
+              record.abstract, record.creator, record.publisher]
+    values.extend(record.subjects or [])
+
+    return u' '.join([value for value in values if value])
+
+
+def record_bbox(record):
+    """return the bbox of a CswRecord as floats, or None"""
+
+    bbox = record.bbox
+    if bbox is None:
+        return None
+    try:
+        return (float(bbox.minx), float(bbox.miny),
+                float(bbox.maxx), float(bbox.maxy))
+    except (TypeError, ValueError):
+        return None
+
+
+def fts_query(keywords):
+    """return an FTS MATCH expression requiring all words of keywords"""
+
+    return u' '.join([u'"%s"' % word.replace('"', '""')
+                      for word in keywords.split()])
+
+
+class RecordStore(object):
+    """SQLite store of catalogue records with keyword and bbox indexes"""
+
+    def __init__(self, filename):
+        """
+        filename is created if needed; a store must only be used from the
+        thread which created it
+        """
+
+        directory = os.path.dirname(filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.row_factory = sqlite3.Row
+
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+        columns = [row['name'] for row in self.connection.execute(
+            'PRAGMA table_info(records)')]
+        if 'esn' not in columns:  # stores created before element sets
+            self.connection.execute('ALTER TABLE records ADD COLUMN esn TEXT')
+        self.fts = self._create_optional(FTS_SCHEMA)
+        self.rtree = self._create_optional(RTREE_SCHEMA)
+        self.connection.commit()
+
+    def _create_optional(self, statement):
+        """create a virtual table, returning False if it is unsupported"""
+
+        try:
+            self.connection.execute(statement)
+        except sqlite3.OperationalError, err:
+            LOGGER.debug('Record store without index: %s', err)
+            return False
+        return True
+
+    def close(self):
+        """close the database"""
+
+        self.connection.close()
+
+    def put(self, url, records, esn='full'):
+        """
+        store CswRecords of element set esn from the catalogue at url;
+        brief or summary records never overwrite full ones
+        """
+
+        url = canonical_url(url)
+        now = time.time()
+
+        with self.connection:
+            for record in records:
+                if not record.identifier:
+                    continue
+                self._put(url, record, now, esn)
+
+    def _put(self, url, record, now, esn):
+        row = self.connection.execute(
+            'SELECT id, esn FROM records WHERE url = ? AND identifier = ?',
+            (url, record.identifier)).fetchone()
+        if row is not None and \
+                ESN_RANK[esn] < ESN_RANK.get(row['esn'], 1):
+            return
+
+        anytext = record_anytext(record)
+        bbox = record_bbox(record) or (None, None, None, None)
+        values = (record.type, record.title, record.modified, anytext) + \
+            bbox + (record.xml.decode('utf-8'), esn, now)
+
+        if row is None:
+            cursor = self.connection.execute(
+                'INSERT INTO records (type, title, modified, anytext, minx, '
+                'miny, maxx, maxy, xml, esn, stored, url, identifier) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                values + (url, record.identifier))
+            rowid = cursor.lastrowid
+        else:
+            rowid = row['id']
+            self.connection.execute(
+                'UPDATE records SET type = ?, title = ?, modified = ?, '
+                'anytext = ?, minx = ?, miny = ?, maxx = ?, maxy = ?, '
+                'xml = ?, esn = ?, stored = ? WHERE id = ?',
+                values + (rowid,))
+
+        if self.fts:
+            self.connection.execute(
+                'DELETE FROM records_fts WHERE docid = ?', (rowid,))
+            self.connection.execute(
+                'INSERT INTO records_fts (docid, anytext) VALUES (?, ?)',
+                (rowid, anytext))
+
+        if self.rtree:
+            self.connection.execute(
+                'DELETE FROM records_rtree WHERE id = ?', (rowid,))
+            if bbox[0] is not None:
+                self.connection.execute(
+                    'INSERT INTO records_rtree (id, minx, maxx, miny, maxy) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (rowid, bbox[0], bbox[2], bbox[1], bbox[3]))
+
+    def remove(self, url=None):
+        """drop the records of the catalogue at url, or all records"""
+
+        if url is None:
+            where, params = '', ()
+        else:
+            where, params = ' WHERE url = ?', (canonical_url(url),)
+
+        with self.connection:
+            if self.fts:
+                self.connection.execute(
+                    'DELETE FROM records_fts WHERE docid IN '
+                    '(SELECT id FROM records%s)' % where, params)
+            if self.rtree:
+                self.connection.execute(
+                    'DELETE FROM records_rtree WHERE id IN '
+                    '(SELECT id FROM records%s)' % where, params)
+            self.connection.execute('DELETE FROM records%s' % where, params)
+            self.connection.execute('DELETE FROM harvests%s' % where, params)
+
+    def get_harvest(self, url):
+        """return the harvest state of the catalogue at url as a dict"""
+
+        row = self.connection.execute(
+            'SELECT since, started, position FROM harvests WHERE url = ?',
+            (canonical_url(url),)).fetchone()
+        if row is None:
+            return {'since': None, 'started': None, 'position': 1}
+        return dict(zip(row.keys(), row))
+
+    def set_harvest(self, url, since, started, position):
+        """record the progress of a harvest"""
+
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO harvests (url, since, started, '
+                'position) VALUES (?, ?, ?, ?)',
+                (canonical_url(url), since, started, position))
+
+    def count(self, url=None):
+        """return the number of records stored for url, or in total"""
+
+        if url is None:
+            row = self.connection.execute(
+                'SELECT COUNT(*) FROM records').fetchone()
+        else:
+            row = self.connection.execute(
+                'SELECT COUNT(*) FROM records WHERE url = ?',
+                (canonical_url(url),)).fetchone()
+        return row[0]
+
+    def search(self, keywords=None, bbox=None, urls=None, startposition=0,
+               maxrecords=10):
+        """
+        return a LocalResults page of the records matching all words of
+        keywords and intersecting bbox (minx, miny, maxx, maxy); urls
+        limits the search to some catalogues
+        """
+
+        where = []
+        params = []
+
+        if keywords and keywords.strip():
+            if self.fts:
+                where.append('id IN (SELECT docid FROM records_fts '
+                             'WHERE records_fts MATCH ?)')
+                params.append(fts_query(keywords))
+            else:
+                for word in keywords.split():
+                    where.append('anytext LIKE ?')
+                    params.append(u'%%%s%%' % word)
+
+        if bbox is not None:
+            minx, miny, maxx, maxy = [float(value) for value in bbox]
+            overlap = 'minx <= ? AND maxx >= ? AND miny <= ? AND maxy >= ?'
+            if self.rtree:
+                where.append('id IN (SELECT id FROM records_rtree '
+                             'WHERE %s)' % overlap)
+            else:
+                where.append(overlap)
+            params.extend([maxx, minx, maxy, miny])
+
+        if urls:
+            where.append('url IN (%s)' % ', '.join('?' * len(urls)))
+            params.extend([canonical_url(url) for url in urls])
+
+        if where:
+            where = ' WHERE %s' % ' AND '.join(where)
+        else:
+            where = ''
+
+        matches = self.connection.execute(
+            'SELECT COUNT(*) FROM records%s' % where, params).fetchone()[0]
+
+        rows = self.connection.execute(
+            'SELECT url, xml, esn FROM records%s ORDER BY title, id '
+            'LIMIT ? OFFSET ?' % where,
+            params + [maxrecords, startposition]).fetchall()
+
+        return LocalResults(self.filename, matches, startposition, rows)
+
+
+class LocalResults(object):
+    """
+    a page of RecordStore search results, shaped like the
+    owslib.csw.CatalogueServiceWeb the dialog displays
+    """
+
+    def __init__(self, filename, matches, startposition, rows):
+        self.url = filename
+        self.request = ''
+        self.records = OrderedDict()
+        # catalogue URL and element set of each record
+        self.urls = {}
+        self.esns = {}
+
+        for row in rows:
+            record = CswRecord(etree.fromstring(row['xml'].encode('utf-8')))
+            self.records[record.identifier] = record
+            self.urls[record.identifier] = row['url']
+            self.esns[record.identifier] = row['esn'] or 'summary'
+
+        returned = len(self.records)
+        nextrecord = startposition + returned + 1
+        if nextrecord > matches:
+            nextrecord = 0
+
+        self.results = {'matches': matches, 'returned': returned,
+                        'nextrecord': nextrecord}
+        self.response = '\n'.join([row['xml'].encode('utf-8')
+                                   for row in rows])
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# CSW Client
+# ---------------------------------------------------------
+# QGIS Catalogue Service client.
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+###############################################################################
+
+from collections import deque
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+LOGGER = logging.getLogger('MetaSearch(Geocode)')
+
+# connect, ttfb and download are recorded by the HTTP transport; parse is
+# the rest of the time spent in OWSLib; populate and render by the dialog
+SPANS = ['connect', 'ttfb', 'download', 'parse', 'populate', 'render']
+NETWORK_SPANS = ['connect', 'ttfb', 'download']
+
+_LOCAL = threading.local()
+
+
+class Timing(object):
+    """durations of the stages of one catalogue operation"""
+
+    def __init__(self, operation, url):
+        self.operation = operation
+        self.url = url
+        self.started = time.time()
+        self.ended = None
+        self.spans = {}
+        self.requests = 0
+        self.size = 0
+        self.failed = None
+
+    def add(self, name, seconds):
+        """add seconds to the span name"""
+
+        self.spans[name] = self.spans.get(name, 0) + seconds
+
+    def get(self, name):
+        """return the duration of a span in milliseconds"""
+
+        return int(round(self.spans.get(name, 0) * 1000))
+
+    def network(self):
+        """return the seconds spent in HTTP requests"""
+
+        return sum([self.spans.get(name, 0) for name in NETWORK_SPANS])
+
+    def elapsed(self):
+        """return the seconds from start to end of the operation"""
+
+        return (self.ended or time.time()) - self.started
+
+    def total(self):
+        """return the sum of all spans in milliseconds"""
+
+        return int(round(sum(self.spans.values()) * 1000))
+
+    def __str__(self):
+        spans = ', '.join(['%s %d ms' % (name, self.get(name))
+                           for name in SPANS if name in self.spans])
+        text = '%s %s: %s (%d requests, %d bytes)' % (
+            self.operation, self.url, spans, self.requests, self.size)
+        if self.failed is not None:
+            text = '%s, failed: %s' % (text, self.failed)
+        return text
+
+
+@contextmanager
+def span(timing, name):
+    """time the enclosed block as span name of timing, which may be None"""
+
+    started = time.time()
+    try:
+        yield
+    finally:
+        if timing is not None:
+            timing.add(name, time.time() - started)
+
+
+def begin(operation, url):
+    """start timing an operation run by the current thread"""
+
+    _LOCAL.timing = Timing(operation, url)
+    return _LOCAL.timing
+
+
+def end():
+    """stop timing the operation of the current thread"""
+
+    timing = current()
+    _LOCAL.timing = None
+    if timing is not None:
+        timing.ended = time.time()
+    return timing
+
+
+def current():
+    """return the Timing of the current thread, or None"""
+
+    return getattr(_LOCAL, 'timing', None)
+
+
+class TimingHistory(object):
+    """rolling history of completed operations"""
+
+    def __init__(self, size=200):
+        self.timings = deque(maxlen=size)
+
+    def add(self, timing):
+        """log a completed operation and keep it"""
+
+        if timing is None:
+            return
+        LOGGER.info('Timing: %s', timing)
+        self.timings.append(timing)
+
+    def items(self):
+        """return the kept operations, most recent first"""
+
+        return list(reversed(self.timings))
+
+    def clear(self):
+        self.timings.clear()
+
+
+HISTORY = TimingHistory()
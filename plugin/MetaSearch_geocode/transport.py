@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# CSW Client
+# ---------------------------------------------------------
+# QGIS Catalogue Service client.
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+###############################################################################
+
+import httplib
+import logging
+import socket
+from StringIO import StringIO
+import threading
+import time
+import urllib
+import urllib2
+import zlib
+
+from MetaSearch_geocode import timing
+
+LOGGER = logging.getLogger('MetaSearch(Geocode)')
+
+# seconds an idle connection is kept; servers drop them after a while
+IDLE_TIMEOUT = 60
+
+
+class ConnectionPool(object):
+    """idle HTTP connections, per host"""
+
+    def __init__(self, maxidle=4):
+        """maxidle is the number of idle connections kept per host"""
+
+        self.maxidle = maxidle
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def get(self, key):
+        """return an idle connection for key, or None"""
+
+        with self.lock:
+            connections = self.idle.get(key, [])
+            while connections:
+                connection, released = connections.pop()
+                if time.time() - released < IDLE_TIMEOUT:
+                    return connection
+                connection.close()
+        return None
+
+    def put(self, key, connection):
+        """return a connection whose response has been read"""
+
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.maxidle:
+                connections.append((connection, time.time()))
+                return
+        connection.close()
+
+    def clear(self):
+        """close all idle connections"""
+
+        with self.lock:
+            for connections in self.idle.values():
+                for connection, released in connections:
+                    connection.close()
+            self.idle.clear()
+
+
+POOL = ConnectionPool()
+
+
+class PooledBody(object):
+    """
+    body of an httplib response; the connection goes back to the pool
+    once the body has been read to the end
+    """
+
+    def __init__(self, pool, key, connection, response, timer=None):
+        """timer is the timing.Timing the download is added to"""
+
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.timer = timer
+        self.started = time.time()
+
+        if response.isclosed():  # no body
+            self._release()
+
+    def recv(self, size=-1):
+        if self.response is None:
+            return ''
+        if size is None or size < 0:
+            data = self.response.read()
+        else:
+            data = self.response.read(size)
+        if self.timer is not None:
+            self.timer.size += len(data)
+        if self.response.isclosed():
+            self._release()
+        return data
+
+    read = recv
+
+    def close(self):
+        if self.response is None:
+            return
+        # a partly read response leaves the connection unusable
+        self.response.close()
+        self.connection.close()
+        self._done()
+
+    def _release(self):
+        if self.response.will_close:
+            self.connection.close()
+        else:
+            self.pool.put(self.key, self.connection)
+        self._done()
+
+    def _done(self):
+        self.response = None
+        if self.timer is not None:
+            self.timer.add('download', time.time() - self.started)
+
+
+class DecodingBody(object):
+    """
+    decodes a gzip or deflate content-encoded body while it is read;
+    decoded data beyond the size asked for is kept for the next read
+    """
+
+    def __init__(self, body, encoding):
+        self.body = body
+        self.encoding = encoding
+        self.started = False
+        self.buffer = ''
+        if encoding == 'deflate':
+            self.decoder = zlib.decompressobj()
+        else:
+            self.decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def recv(self, size=-1):
+        if size is None or size < 0:
+            chunks = [self.buffer]
+            while self.decoder is not None:
+                chunks.append(self._decode(-1))
+            self.buffer = ''
+            return ''.join(chunks)
+
+        # socket._fileobject asserts that no more than size is returned
+        while not self.buffer and self.decoder is not None:
+            self.buffer = self._decode(size)
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+    read = recv
+
+    def close(self):
+        self.body.close()
+
+    def _decode(self, size):
+        data = self.body.recv(size)
+        if not data:
+            data = self.decoder.flush()
+            self.decoder = None
+            return data
+
+        if not self.started and self.encoding == 'deflate':
+            # some servers send raw deflate data without zlib header
+            self.started = True
+            try:
+                return self.decoder.decompress(data)
+            except zlib.error:
+                self.decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self.decoder.decompress(data)
+
+
+class KeepAliveHandler(urllib2.HTTPHandler):
+    """urllib2 handler for http URLs using pooled connections"""
+
+    def __init__(self, pool=POOL):
+        urllib2.HTTPHandler.__init__(self)
+        self.pool = pool
+
+    def http_open(self, req):
+        return pooled_open(self.pool, 'http', httplib.HTTPConnection, req)
+
+
+class KeepAliveHTTPSHandler(urllib2.HTTPSHandler):
+    """urllib2 handler for https URLs using pooled connections"""
+
+    def __init__(self, pool=POOL):
+        urllib2.HTTPSHandler.__init__(self)
+        self.pool = pool
+
+    def https_open(self, req):
+        kwargs = {}
+        context = getattr(self, '_context', None)
+        if context is not None:
+            kwargs['context'] = context
+        return pooled_open(self.pool, 'https', httplib.HTTPSConnection, req,
+                           **kwargs)
+
+
+class CachingHandler(urllib2.BaseHandler):
+    """
+    answers GET requests from a cache.HTTPCache; stale entries are
+    revalidated with If-None-Match and If-Modified-Since, so that an
+    unchanged document comes back as 304 Not Modified without a body
+    """
+
+    # opens before the keep-alive handlers, sees responses before
+    # urllib2.HTTPErrorProcessor turns a 304 into an error
+    handler_order = 400
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def cacheable(self, req):
+        return all([req.get_method() == 'GET',
+                    not req.has_header('Authorization'),
+                    'no-cache' not in req.get_header('Cache-control', ''),
+                    'no-cache' not in req.get_header('Pragma', '')])
+
+    def http_request(self, req):
+        if not self.cacheable(req):
+            return req
+
+        # looked up once; http_open answers from the same entry
+        entry = req._cache_entry = self.cache.get(req.get_full_url())
+        if entry is not None and entry['fresh_until'] <= time.time():
+            if entry['etag']:
+                req.add_unredirected_header('If-None-Match', entry['etag'])
+            if entry['last_modified']:
+                req.add_unredirected_header('If-Modified-Since',
+                                            entry['last_modified'])
+        return req
+
+    def http_open(self, req):
+        if not self.cacheable(req):
+            return None
+
+        entry = getattr(req, '_cache_entry', None)
+        if entry is None or entry['fresh_until'] <= time.time():
+            return None  # ask the server
+        LOGGER.debug('Cached: %s', req.get_full_url())
+        return self.cached_response(req, entry)
+
+    def http_response(self, req, response):
+        if not self.cacheable(req):
+            return response
+
+        url = req.get_full_url()
+        if response.code == 304:
+            response.read()  # releases the connection
+            response.close()
+            entry = self.cache.refresh(url, response.info())
+            if entry is not None:
+                LOGGER.debug('Not modified: %s', url)
+                return self.cached_response(req, entry)
+        elif response.code == 200 and self.cache.storable(response.info()):
+            body = response.read()
+            response.close()
+            self.cache.put(url, response.info(), body)
+            cached = urllib.addinfourl(StringIO(body), response.info(), url)
+            cached.code = response.code
+            cached.msg = response.msg
+            return cached
+        return response
+
+    https_request = http_request
+    https_open = http_open
+    https_response = http_response
+
+    def cached_response(self, req, entry):
+        headers = 'Content-Type: %s\r\nContent-Length: %d\r\n\r\n' % (
+            entry['content_type'] or 'application/octet-stream',
+            len(entry['body']))
+        response = urllib.addinfourl(StringIO(entry['body']),
+                                     httplib.HTTPMessage(StringIO(headers)),
+                                     req.get_full_url())
+        response.code = 200
+        response.msg = 'OK'
+        return response
+
+
+def pooled_open(pool, scheme, connection_class, req, **kwargs):
+    """
+    send req over a pooled connection; mirrors
+    urllib2.AbstractHTTPHandler.do_open
+    """
+
+    host = req.get_host()
+    if not host:
+        raise urllib2.URLError('no host given')
+
+    headers = dict(req.unredirected_hdrs)
+    headers.update(dict((name, value) for name, value in req.headers.items()
+                        if name not in headers))
+    headers = dict((name.title(), value) for name, value in headers.items())
+    headers['Connection'] = 'keep-alive'
+    headers.setdefault('Accept-Encoding', 'gzip, deflate')
+
+    tunnel_host = req._tunnel_host
+    tunnel_headers = {}
+    if tunnel_host and 'Proxy-Authorization' in headers:
+        tunnel_headers['Proxy-Authorization'] = \
+            headers.pop('Proxy-Authorization')
+
+    key = (scheme, host, tunnel_host)
+    timeout = req.timeout
+    if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+        timeout = socket.getdefaulttimeout()
+
+    timer = timing.current()
+
+    connection = pool.get(key)
+    while True:
+        reused = connection is not None
+        if reused and connection.sock is not None:
+            connection.sock.settimeout(timeout)
+
+        try:
+            if not reused:
+                connection = connection_class(host, timeout=timeout,
+                                              **kwargs)
+                if tunnel_host:
+                    connection.set_tunnel(tunnel_host,
+                                          headers=tunnel_headers)
+                with timing.span(timer, 'connect'):
+                    connection.connect()
+
+            with timing.span(timer, 'ttfb'):
+                connection.request(req.get_method(), req.get_selector(),
+                                   req.data, headers)
+                response = connection.getresponse(buffering=True)
+            break
+        except (socket.error, httplib.HTTPException), err:
+            if connection is not None:
+                connection.close()
+            if not reused:
+                raise urllib2.URLError(err)
+            # the server closed the idle connection; retry on a new one
+            LOGGER.debug('Stale connection to %s: %s', host, err)
+            connection = None
+
+    if timer is not None:
+        timer.requests += 1
+    body = PooledBody(pool, key, connection, response, timer)
+
+    msg = response.msg
+    encoding = (msg.getheader('content-encoding') or '').strip().lower()
+    if encoding in ['gzip', 'x-gzip', 'deflate']:
+        body = DecodingBody(body, encoding)
+        # callers see the decoded body
+        del msg['content-encoding']
+        del msg['content-length']
+
+    fp = socket._fileobject(body, close=True)
+    resp = urllib.addinfourl(fp, msg, req.get_full_url())
+    resp.code = response.status
+    resp.msg = response.reason
+    return resp
+
+
+def install(proxies=None, cache=None):
+    """
+    install the keep-alive transport as the global urllib2 opener, so
+    that OWSLib and geopy requests use it too; proxies maps URL schemes
+    to proxy URLs, None uses the environment.  GET responses are kept in
+    cache, a cache.HTTPCache, if given
+    """
+
+    handlers = [KeepAliveHandler(), KeepAliveHTTPSHandler()]
+    if proxies is not None:
+        handlers.insert(0, urllib2.ProxyHandler(proxies))
+    if cache is not None:
+        handlers.append(CachingHandler(cache))
+
+    urllib2.install_opener(urllib2.build_opener(*handlers))
@@ -38,6 +38,7 @@ from pygments.lexers import XmlLexer
 from pygments.formatters import HtmlFormatter
 from PyQt4.QtGui import QMessageBox
 from PyQt4.uic import loadUiType
+from qgis.core import QgsApplication
 
 LOGGER = logging.getLogger('MetaSearch(Geocode)')
 
@@ -59,6 +60,13 @@ def get_ui_class(ui_file):
     return loadUiType(ui_file_full)[0]
 
 
+def get_cache_dir(name):
+    """return path of a MetaSearch cache directory in the QGIS profile"""
+
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), 'MetaSearch',
+                        'cache', name)
+
+
 def render_template(language, context, data, template):
     """Renders HTML display of metadata XML"""
 
@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# CSW Client
+# ---------------------------------------------------------
+# QGIS Catalogue Service client.
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+###############################################################################
+
+import copy
+from functools import partial
+import logging
+import time
+
+from PyQt4.QtCore import QMutex, QObject, QThread, QTimer, pyqtSignal
+
+from owslib.fes import PropertyIsGreaterThanOrEqualTo
+
+from MetaSearch_geocode import timing
+from MetaSearch_geocode.catalogue import CatalogueClient
+from MetaSearch_geocode.health import is_transient
+from MetaSearch_geocode.store import RecordStore
+
+LOGGER = logging.getLogger('MetaSearch(Geocode)')
+
+
+class Cancelled(Exception):
+    """raised to abandon a request which is no longer wanted"""
+
+
+class CSW_Worker(QThread):
+    """runs CSW requests off the GUI thread"""
+
+    resultsReady = pyqtSignal(object)
+    recordReady = pyqtSignal(object)
+    error = pyqtSignal(str, object)
+
+    def __init__(self, parent=None, capabilities_cache=None):
+        super(CSW_Worker, self).__init__(parent)
+
+        self.mutex = QMutex()
+        self.capabilities_cache = capabilities_cache
+        self.stopped = False
+        self.operation = None
+        self.url = None
+        self.timeout = 10
+        self.catalog = None
+        self.kwargs = {}
+        self.callback = None
+        self.stream = False
+        self.no_cache = False
+        self.timing = None
+        self.retries = 0
+        self.backoff = 0.5
+        self.health = None  # EndpointHealth, set by the dialog
+        self.request_key = None  # identifies the request, for the dialog
+        self.stage = None
+        self.parsed = 0
+
+    def initialize(self, operation, url, timeout, catalog=None, **kwargs):
+        """
+        set up the request to run
+
+        operation is one of 'capabilities', 'getrecords' or 'getrecordbyid';
+        kwargs are passed through to the OWSLib call.  When a catalog is
+        given, its GetCapabilities response is reused.  Set stream to have
+        GetRecords emit recordReady for each record as it is parsed, and
+        retries to retry transient failures after backoff, 2 * backoff, ...
+        seconds.  Set no_cache to send GetCapabilities past the caches
+        """
+
+        self.operation = operation
+        self.url = url
+        self.timeout = timeout
+        self.catalog = catalog
+        self.kwargs = kwargs
+
+    def run(self):
+        # spans of the HTTP requests are recorded by the transport
+        self.timing = timing.begin(self.operation, self.url)
+        started = time.time()
+
+        failure = None
+        attempt = 0
+        try:
+            while True:
+                self.stage = 'connect'
+                self.parsed = 0
+                try:
+                    catalog = self._request()
+                    break
+                except Cancelled:
+                    return
+                except Exception as err:
+                    LOGGER.debug('CSW %s failed (%s): %s', self.operation,
+                                 self.stage, err)
+                    # records already shown cannot be taken back
+                    if all([attempt < self.retries, self.parsed == 0,
+                            is_transient(err)]):
+                        delay = self.backoff * 2 ** attempt
+                        attempt += 1
+                        LOGGER.debug('Retrying in %.1f s', delay)
+                        if self._sleep(delay):
+                            continue
+                    failure = self.stage, err
+                    self.timing.failed = '%s: %s' % (self.stage, err)
+                    break
+        finally:
+            # the time not spent in HTTP requests went into parsing
+            timing.end()
+            self.timing.add('parse', max(0, time.time() - started -
+                                         self.timing.network()))
+
+        if self.isStopped():
+            return
+        if failure is not None:
+            self.error.emit(*failure)
+        else:
+            self.resultsReady.emit(catalog)
+
+    def _request(self):
+        if self.catalog is None:
+            catalog = CatalogueClient(
+                self.url, timeout=self.timeout,
+                capabilities_cache=self.capabilities_cache,
+                no_cache=self.no_cache)
+        else:
+            # work on a copy so that a cancelled request never
+            # clobbers the catalogue the dialog is displaying
+            catalog = copy.copy(self.catalog)
+            catalog.timeout = self.timeout
+        if self.isStopped():
+            raise Cancelled()
+
+        self.stage = 'request'
+        if self.operation == 'getrecords' and self.stream:
+            catalog.getrecords2(record_callback=self._record_parsed,
+                                **self.kwargs)
+        elif self.operation == 'getrecords':
+            catalog.getrecords2(**self.kwargs)
+        elif self.operation == 'getrecordbyid':
+            catalog.getrecordbyid(**self.kwargs)
+        return catalog
+
+    def _sleep(self, seconds):
+        """wait before a retry; return False if stopped meanwhile"""
+
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            if self.isStopped():
+                return False
+            self.msleep(100)
+        return not self.isStopped()
+
+    def _record_parsed(self, record):
+        if self.isStopped():  # stop downloading
+            raise Cancelled()
+        self.parsed += 1
+        self.recordReady.emit(record)
+
+    def stop(self):
+        try:
+            self.mutex.lock()
+            self.stopped = True
+        finally:
+            self.mutex.unlock()
+
+    def isStopped(self):
+        try:
+            self.mutex.lock()
+            return self.stopped
+        finally:
+            self.mutex.unlock()
+
+
+class Harvest_Worker(QThread):
+    """copies the records of a catalogue into a store.RecordStore"""
+
+    progress = pyqtSignal(int, int)
+    completed = pyqtSignal(int)
+    error = pyqtSignal(str, object)
+
+    def __init__(self, parent=None, capabilities_cache=None):
+        super(Harvest_Worker, self).__init__(parent)
+
+        self.mutex = QMutex()
+        self.capabilities_cache = capabilities_cache
+        self.stopped = False
+        self.url = None
+        self.timeout = 10
+        self.filename = None
+        self.pagesize = 50
+
+    def initialize(self, url, timeout, filename, pagesize=50):
+        """
+        harvest url into the record store in filename, pagesize records
+        at a time.  Once a harvest has completed, later runs only fetch
+        records modified since; an interrupted run resumes where it stopped
+        """
+
+        self.url = url
+        self.timeout = timeout
+        self.filename = filename
+        self.pagesize = pagesize
+
+    def run(self):
+        stage = 'connect'
+        store = None
+        try:
+            # sqlite connections cannot be shared between threads
+            store = RecordStore(self.filename)
+
+            state = store.get_harvest(self.url)
+            since = state['since']
+            if state['started'] is None:  # new run
+                started = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+                position = 1
+                store.set_harvest(self.url, since, started, position)
+            else:
+                started = state['started']
+                position = state['position']
+                LOGGER.debug('Resuming harvest of %s at %d', self.url,
+                             position)
+
+            constraints = []
+            if since is not None:
+                constraints.append(
+                    PropertyIsGreaterThanOrEqualTo('dct:modified', since))
+
+            catalog = CatalogueClient(
+                self.url, timeout=self.timeout,
+                capabilities_cache=self.capabilities_cache)
+
+            stage = 'request'
+            while not self.isStopped():
+                catalog.getrecords2(constraints=constraints,
+                                    startposition=position,
+                                    maxrecords=self.pagesize, esn='full')
+                store.put(self.url, catalog.records.values())
+
+                returned = catalog.results['returned']
+                matches = catalog.results['matches']
+                nextrecord = catalog.results['nextrecord']
+
+                if nextrecord > position:
+                    position = nextrecord
+                else:
+                    position += returned
+
+                if returned == 0 or nextrecord == 0 or position > matches:
+                    break
+
+                store.set_harvest(self.url, since, started, position)
+                self.progress.emit(position, matches)
+
+            if self.isStopped():  # resume from position next time
+                return
+
+            store.set_harvest(self.url, started, None, 1)
+            self.progress.emit(matches, matches)
+        except Exception as err:
+            LOGGER.debug('Harvest of %s failed (%s): %s', self.url, stage,
+                         err)
+            if not self.isStopped():
+                self.error.emit(stage, err)
+            return
+        finally:
+            if store is not None:
+                store.close()
+
+        self.completed.emit(matches)
+
+    def stop(self):
+        try:
+            self.mutex.lock()
+            self.stopped = True
+        finally:
+            self.mutex.unlock()
+
+    def isStopped(self):
+        try:
+            self.mutex.lock()
+            return self.stopped
+        finally:
+            self.mutex.unlock()
+
+
+class FederatedSearch(QObject):
+    """runs the same CSW request against several catalogues at once"""
+
+    resultsReady = pyqtSignal(object, object, object)
+    error = pyqtSignal(object, str, object, object)
+    done = pyqtSignal()
+
+    def __init__(self, parent=None, capabilities_cache=None, concurrency=4):
+        super(FederatedSearch, self).__init__(parent)
+
+        self.capabilities_cache = capabilities_cache
+        self.concurrency = concurrency
+        self.queue = []
+        self.running = {}
+        self.workers = set()
+        self.timeout = 10
+        self.retries = 0
+        self.no_cache = False
+        self.operation = 'getrecords'
+        self.kwargs = {}
+        self.stopped = False
+
+    def start(self, connections, timeout, retries=0, operation='getrecords',
+              no_cache=False, **kwargs):
+        """
+        query connections, a list of (name, url, timeout) tuples; at most
+        concurrency catalogues are queried at the same time and each one
+        is given its timeout in seconds, or timeout if None, to answer.
+        operation and kwargs are as for CSW_Worker.initialize, no_cache
+        and retries are set on each CSW_Worker
+        """
+
+        self.queue = list(connections)
+        self.timeout = timeout
+        self.retries = retries
+        self.no_cache = no_cache
+        self.operation = operation
+        self.kwargs = kwargs
+        self.stopped = False
+
+        for i in range(min(self.concurrency, len(self.queue))):
+            self._start_next()
+
+        if not self.running:
+            self.done.emit()
+
+    def stop(self):
+        """abandon all outstanding requests"""
+
+        self.stopped = True
+        self.queue = []
+        for worker, timer in self.running.values():
+            timer.stop()
+            worker.stop()
+        self.running.clear()
+
+    def _start_next(self):
+        if self.stopped or not self.queue:
+            if not self.running:
+                self.done.emit()
+            return
+
+        name, url, timeout = self.queue.pop(0)
+        if timeout is None:
+            timeout = self.timeout
+
+        worker = CSW_Worker(self, self.capabilities_cache)
+        worker.initialize(self.operation, url, timeout, **self.kwargs)
+        worker.retries = self.retries
+        worker.no_cache = self.no_cache
+        worker.resultsReady.connect(self._worker_results)
+        worker.error.connect(self._worker_error)
+        worker.finished.connect(self._worker_done)
+
+        # per endpoint deadline, covering capabilities and GetRecords
+        timer = QTimer(self)
+        timer.setSingleShot(True)
+        timer.timeout.connect(partial(self._expire, name))
+        timer.start(timeout * 1000)
+
+        self.workers.add(worker)
+        self.running[name] = (worker, timer)
+        worker.start()
+
+    def _release(self, worker):
+        """forget a running worker, returning its connection name"""
+
+        for name, (running, timer) in self.running.items():
+            if running is worker:
+                timer.stop()
+                del self.running[name]
+                return name
+
+    def _worker_results(self, catalog):
+        worker = self.sender()
+        timing.HISTORY.add(worker.timing)
+        name = self._release(worker)
+        if name is None:  # expired or stopped
+            return
+        self.resultsReady.emit(name, catalog, worker.timing)
+        self._start_next()
+
+    def _worker_error(self, stage, err):
+        worker = self.sender()
+        timing.HISTORY.add(worker.timing)
+        name = self._release(worker)
+        if name is None:
+            return
+        self.error.emit(name, stage, err, worker.timing)
+        self._start_next()
+
+    def _worker_done(self):
+        worker = self.sender()
+        self.workers.discard(worker)
+        worker.deleteLater()
+
+    def _expire(self, name):
+        if name not in self.running:
+            return
+        worker, timer = self.running.pop(name)
+        worker.stop()
+        self.error.emit(name, 'timeout', None, worker.timing)
+        self._start_next()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+###############################################################################
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import gzip
+import shutil
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+import tempfile
+import threading
+import unittest
+import urllib2
+import zlib
+
+import tests  # noqa
+from MetaSearch_geocode import transport
+from MetaSearch_geocode.cache import HTTPCache
+
+BODY = ''.join(['<record id="%d">%s</record>\n' % (i, 'x' * (i % 97))
+                for i in xrange(20000)])
+
+
+def gzipped(data):
+    out = StringIO()
+    with gzip.GzipFile(fileobj=out, mode='wb') as fileobj:
+        fileobj.write(data)
+    return out.getvalue()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    hits = 0
+
+    def do_GET(self):
+        if self.path == '/cached':
+            Handler.hits += 1
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/xml')
+            self.send_header('Cache-Control', 'max-age=60')
+            self.send_header('Content-Length', str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+            return
+        if self.path == '/deflate':
+            encoding, data = 'deflate', zlib.compress(BODY)
+        else:
+            encoding, data = 'gzip', gzipped(BODY)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ServerTestCase(unittest.TestCase):
+    """runs Handler in the background"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = Server(('127.0.0.1', 0), Handler)
+        cls.url = 'http://127.0.0.1:%d' % cls.server.server_address[1]
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.pool = transport.ConnectionPool()
+        cls.opener = urllib2.build_opener(
+            transport.KeepAliveHandler(cls.pool))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.clear()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+class DecodingBodyTest(ServerTestCase):
+    """compressed responses read through the keep-alive transport"""
+
+    def read_chunks(self, path, size):
+        response = self.opener.open(self.url + path)
+        chunks = []
+        while True:
+            chunk = response.read(size)
+            self.assertTrue(len(chunk) <= size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        response.close()
+        return ''.join(chunks)
+
+    def test_gzip_sized_reads(self):
+        self.assertEqual(self.read_chunks('/gzip', 16384), BODY)
+
+    def test_gzip_small_reads(self):
+        self.assertEqual(self.read_chunks('/gzip', 100), BODY)
+
+    def test_deflate_sized_reads(self):
+        self.assertEqual(self.read_chunks('/deflate', 16384), BODY)
+
+    def test_full_read(self):
+        response = self.opener.open(self.url + '/gzip')
+        self.assertEqual(response.read(), BODY)
+
+    def test_lines(self):
+        response = self.opener.open(self.url + '/gzip')
+        self.assertEqual(''.join(response.readlines()), BODY)
+
+
+class CachingHandlerTest(ServerTestCase):
+    """GET responses answered from a cache.HTTPCache"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = HTTPCache(self.directory)
+        self.opener = urllib2.build_opener(
+            transport.KeepAliveHandler(self.pool),
+            transport.CachingHandler(self.cache))
+        Handler.hits = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get(self, **headers):
+        req = urllib2.Request(self.url + '/cached', headers=headers)
+        return self.opener.open(req).read()
+
+    def test_fresh_from_cache(self):
+        self.assertEqual(self.get(), BODY)
+        self.assertEqual(self.get(), BODY)
+        self.assertEqual(Handler.hits, 1)
+
+    def test_single_lookup(self):
+        lookups = []
+        get = self.cache.get
+        self.cache.get = lambda url: lookups.append(url) or get(url)
+        self.get()
+        self.get()
+        self.assertEqual(len(lookups), 2)
+
+    def test_no_cache(self):
+        self.get()
+        self.assertEqual(self.get(**{'Cache-Control': 'no-cache'}), BODY)
+        self.assertEqual(self.get(Pragma='no-cache'), BODY)
+        self.assertEqual(Handler.hits, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()